@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connections
+from django.http import HttpResponse
+
+from foodgram.streaming import OffloadedStreamingResponse, copy_headers
+from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+
+
+def materialize(response):
+    """Return a rendered response as a plain ``HttpResponse``.
+
+    Rendering here keeps the serializers off the event loop and off
+    Django's shared sync thread.
+    """
+    if hasattr(response, 'render'):
+        response.render()
+    materialized = HttpResponse(
+        response.content, status=response.status_code
+    )
+    copy_headers(response, materialized)
+    return materialized
+
+
+def offload(view, streaming=False):
+    """Turn a sync view into a coroutine running it in a worker thread.
+
+    Django 3.2 has no async ORM, and runs all sync views of an ASGI server
+    one at a time in a single thread. Every request of an offloaded view
+    gets a thread of the default executor instead, so slow queries do not
+    queue behind each other, and the event loop is free to send responses
+    to slow clients while other requests are served. Views returning
+    streaming responses get a thread of their own, which goes on to
+    produce the body chunk by chunk, see ``OffloadedStreamingResponse``.
+    """
+    def run(request, executor, *args, **kwargs):
+        close_old_connections()
+        streamed = False
+        try:
+            response = view(request, *args, **kwargs)
+            if response.streaming:
+                streamed = True
+                return OffloadedStreamingResponse(response, executor)
+            return materialize(response)
+        finally:
+            if streaming and not streamed:
+                # The thread of its own is about to go away.
+                connections.close_all()
+            elif not streamed:
+                close_old_connections()
+
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        executor = ThreadPoolExecutor(max_workers=1) if streaming else None
+        try:
+            response = await sync_to_async(
+                run, thread_sensitive=False, executor=executor
+            )(request, executor, *args, **kwargs)
+        except BaseException:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            raise
+        if executor is not None and not response.streaming:
+            executor.shutdown(wait=False)
+        return response
+
+    return async_view
+
+
+recipe_list = offload(
+    RecipeViewSet.as_view({'get': 'list'}, basename='recipes', detail=False)
+)
+recipe_detail = offload(
+    RecipeViewSet.as_view({'get': 'retrieve'}, basename='recipes',
+                          detail=True)
+)
+download_shopping_cart = offload(
+    RecipeViewSet.as_view(
+        {'get': 'download_shopping_cart'}, basename='recipes', detail=False,
+        **RecipeViewSet.download_shopping_cart.kwargs
+    ),
+    streaming=True
+)
+tag_list = offload(
+    TagViewSet.as_view({'get': 'list'}, basename='tags', detail=False)
+)
+tag_detail = offload(
+    TagViewSet.as_view({'get': 'retrieve'}, basename='tags', detail=True)
+)
+ingredient_list = offload(
+    IngredientViewSet.as_view({'get': 'list'}, basename='ingredients',
+                              detail=False)
+)
+ingredient_detail = offload(
+    IngredientViewSet.as_view({'get': 'retrieve'}, basename='ingredients',
+                              detail=True)
+)
@@ -0,0 +1,92 @@
+import copy
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .caching import VERSION_KEY, bump_version, get_version
+
+
+def revocation_version(key):
+    # Read without seeding, so made-up keys leave nothing in the cache.
+    return cache.get(VERSION_KEY.format(f'token:{key}'))
+
+
+def revoke_token(key):
+    bump_version(f'token:{key}')
+
+
+class TokenCache:
+    """Per-process LRU of token keys resolved to their users.
+
+    Entries expire after ``TOKEN_CACHE_TIMEOUT`` seconds and at most
+    ``TOKEN_CACHE_SIZE`` of them are kept. Each entry remembers the
+    revocation version of its token, which lives in the shared Django
+    cache: signals bump it when the token is deleted or its user changes,
+    and every process drops its entry on the next hit.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, user, token, version = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        if revocation_version(key) != version:
+            self.evict(key)
+            return None
+        return user, token
+
+    def set(self, key, user, token, version):
+        expires = time.monotonic() + settings.TOKEN_CACHE_TIMEOUT
+        with self.lock:
+            self.entries[key] = (expires, user, token, version)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def evict(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication resolving warm tokens without a query.
+
+    Every request gets its own copy of the cached user, so changes a view
+    makes to ``request.user`` never leak into other requests.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            # Read before the lookup: a revocation committed after it
+            # leaves the entry with an outdated version.
+            version = revocation_version(key)
+            user, token = super().authenticate_credentials(key)
+            if version is None:
+                get_version(f'token:{key}')
+            cached = (copy.copy(user), token)
+            token_cache.set(key, *cached, version)
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return copy.copy(user), token
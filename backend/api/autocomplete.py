@@ -0,0 +1,99 @@
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from threading import Lock
+
+from recipes.models import Ingredient
+from .caching import get_version
+
+
+def trigrams(value):
+    value = f'  {value} '
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+# One build of the index. A rebuild publishes a new snapshot with a single
+# assignment, so a search always reads the parts of the same build.
+Snapshot = namedtuple(
+    'Snapshot', ['keys', 'ingredients', 'trigrams', 'trigram_counts']
+)
+
+
+class IngredientIndex:
+    """In-process autocomplete index over the ingredient catalog.
+
+    Names are kept lowercased in a sorted list, so prefix matches are a
+    binary search. Substring and trigram matches are used to fill the
+    remaining places when there are not enough prefix matches. The index
+    is rebuilt lazily once the ``ingredients`` version changes.
+    """
+    trigram_threshold = 0.3
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.snapshot = Snapshot([], [], {}, [])
+
+    def refresh(self):
+        version = get_version('ingredients')
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            ingredients = sorted(
+                Ingredient.objects.all(), key=lambda item: item.name.lower()
+            )
+            index = {}
+            counts = []
+            for position, ingredient in enumerate(ingredients):
+                name_trigrams = trigrams(ingredient.name.lower())
+                counts.append(len(name_trigrams))
+                for trigram in name_trigrams:
+                    index.setdefault(trigram, []).append(position)
+            self.snapshot = Snapshot(
+                [ingredient.name.lower() for ingredient in ingredients],
+                ingredients, index, counts
+            )
+            self.version = version
+
+    def search(self, query, limit):
+        self.refresh()
+        query = query.strip().lower()
+        snapshot = self.snapshot
+        keys, ingredients = snapshot.keys, snapshot.ingredients
+        if not query:
+            return ingredients[:limit]
+
+        found = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(found) < limit
+               and keys[position].startswith(query)):
+            found.append(position)
+            position += 1
+        if len(found) < limit:
+            for position, key in enumerate(keys):
+                if query in key and not key.startswith(query):
+                    found.append(position)
+                    if len(found) == limit:
+                        break
+        if not found:
+            found = self.search_trigrams(snapshot, query, limit)
+        return [ingredients[position] for position in found]
+
+    def search_trigrams(self, snapshot, query, limit):
+        query_trigrams = trigrams(query)
+        matches = Counter()
+        for trigram in query_trigrams:
+            matches.update(snapshot.trigrams.get(trigram, ()))
+        scored = []
+        for position, shared in matches.items():
+            similarity = shared / (
+                len(query_trigrams) + snapshot.trigram_counts[position]
+                - shared
+            )
+            if similarity >= self.trigram_threshold:
+                scored.append((-similarity, position))
+        return [position for _, position in sorted(scored)[:limit]]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,31 @@
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'api:version:{}'
+
+
+def get_version(name):
+    """Return the current change counter of the ``name`` data set.
+
+    The counter lives in the Django cache so every worker sharing the
+    cache sees the same value. A missing counter is seeded from the
+    clock, so a counter lost on eviction never goes back to a value
+    that was already handed out.
+    """
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Mark the ``name`` data set as changed."""
+    key = VERSION_KEY.format(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+        return cache.get(key)
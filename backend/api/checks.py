@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """The change counters of ``api.caching`` live in the default cache, so
+    every web worker and management command has to share it."""
+    if (settings.DEBUG or settings.CACHES['default']['BACKEND']
+            not in PROCESS_LOCAL_CACHES):
+        return []
+    return [Error(
+        'The default cache is local to each process.',
+        hint=('Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by '
+              'all processes, such as memcached. Otherwise the workers '
+              'never see the data changes other processes make, and keep '
+              'serving cached pages and indexes of the old data.'),
+        id='api.E001',
+    )]
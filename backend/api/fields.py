@@ -0,0 +1,76 @@
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+from recipes.images import RENDITION_FORMATS, clean_image, decode_base64
+
+
+class RecipeImageField(Base64ImageField):
+    """Base64 image field that decodes in chunks and strips metadata."""
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        try:
+            return clean_image(decode_base64(data))
+        except ValueError:
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+
+
+class RenditionsMixin:
+    """Helpers for read-only fields built from ``Recipe.image_renditions``."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def build_url(self, recipe, name):
+        url = recipe.image.storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_renditions(self, recipe, image_format):
+        """Return ``(width, name)`` pairs of one format, narrowest first.
+
+        Renditions of a replaced image are ignored until the new ones have
+        been rendered.
+        """
+        renditions = recipe.image_renditions
+        if not recipe.image or renditions.get('source') != recipe.image.name:
+            return []
+        return sorted(
+            (int(width), name)
+            for width, name in renditions.get(image_format, {}).items()
+        )
+
+
+class ImageSrcsetField(RenditionsMixin, serializers.Field):
+    """``srcset`` strings of the image renditions, one per format."""
+
+    def to_representation(self, recipe):
+        srcset = {}
+        for image_format in RENDITION_FORMATS:
+            renditions = self.get_renditions(recipe, image_format)
+            if renditions:
+                srcset[image_format] = ', '.join(
+                    f'{self.build_url(recipe, name)} {width}w'
+                    for width, name in renditions
+                )
+        return srcset
+
+
+class ThumbnailField(RenditionsMixin, serializers.Field):
+    """URL of the narrowest JPEG rendition, or of the original image while
+    the renditions are not ready."""
+
+    def to_representation(self, recipe):
+        renditions = self.get_renditions(recipe, 'jpeg')
+        if renditions:
+            return self.build_url(recipe, renditions[0][1])
+        if not recipe.image:
+            return None
+        return self.build_url(recipe, recipe.image.name)
@@ -1,21 +1,60 @@
+from threading import Lock
+
 import django_filters as filters
-from rest_framework.filters import SearchFilter
+from django.db.models import F
+
+from recipes.models import Recipe, Tag, User
+from recipes.services import search_recipes, tag_bit
+from .caching import get_version
+
+
+class TagMap:
+    """Process-local ``slug -> tag id`` map, reloaded when tags change."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.ids = {}
 
-from recipes.models import Recipe, User
+    def get(self):
+        version = get_version('tags')
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.ids = dict(Tag.objects.values_list('slug', 'id'))
+                    self.version = version
+        return self.ids
 
 
-class IngredientNameFilter(SearchFilter):
-    search_param = 'name'
+tag_map = TagMap()
+
+
+def tag_choices():
+    return [(slug, slug) for slug in tag_map.get()]
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags'
     )
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all()
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ['tags', 'author']
+        fields = ['tags', 'author', 'search']
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_tags(self, queryset, name, value):
+        tag_ids = [tag_map.get()[slug] for slug in value]
+        bits = [tag_bit(tag_id) for tag_id in tag_ids]
+        if None in bits:
+            return queryset.filter(tags__id__in=tag_ids).distinct()
+        return queryset.alias(
+            matched_tags=F('tags_mask').bitand(sum(bits))
+        ).filter(matched_tags__gt=0)
@@ -0,0 +1,422 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import StringIO
+from threading import Barrier, local
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorite, Follow, Ingredient, IngredientInRecipe,
+                            PurchaseList, Recipe, Tag, User)
+from recipes.management.commands.load_ingredients import DEFAULT_PATH
+from recipes.services import (backfill_feed, rebuild_cart_totals,
+                              update_search_vectors)
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAA'
+    'A1BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAAeIhvDMAAAAASUV'
+    'ORK5CYII='
+)
+
+
+class Command(BaseCommand):
+    help = ('Seed a test database with a synthetic dataset and measure the '
+            'queries, latency and memory of the main API endpoints.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument('--follows', type=int, default=10,
+                            help='Authors followed by every user.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Favorite recipes of every user.')
+        parser.add_argument('--cart', type=int, default=10,
+                            help='Recipes in the shopping cart of every user.')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--concurrency', type=int, default=20,
+            help='Parallel requests when comparing the WSGI and ASGI paths, '
+                 '0 to skip the comparison.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--ingredients', default=str(DEFAULT_PATH))
+        parser.add_argument('--output', help='Write the JSON results here.')
+        parser.add_argument('--keepdb', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        if options['concurrency'] < 0:
+            raise CommandError('--concurrency must not be negative.')
+        runner = DiscoverRunner(
+            verbosity=0, interactive=False, keepdb=options['keepdb']
+        )
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp(),
+                                   RECIPE_IMAGE_WORKERS=0):
+                self.rng = random.Random(options['seed'])
+                started = time.perf_counter()
+                self.seed(options)
+                seed_time = time.perf_counter() - started
+                results = self.run_scenarios(options['repeat'])
+                concurrency = {}
+                if options['concurrency']:
+                    concurrency = self.compare_servers(
+                        options['repeat'], options['concurrency']
+                    )
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        report = json.dumps({
+            'meta': self.meta(options, seed_time),
+            'results': results,
+            'concurrency': concurrency,
+        }, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def meta(self, options, seed_time):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                cwd=settings.BASE_DIR, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'date': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'seed_seconds': round(seed_time, 3),
+            'options': {
+                name: options[name] for name in (
+                    'users', 'recipes', 'follows', 'favorites', 'cart',
+                    'repeat', 'seed', 'concurrency'
+                )
+            },
+        }
+
+    def seed(self, options):
+        rng = self.rng
+        call_command('load_ingredients', options['ingredients'],
+                     stdout=StringIO())
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        Tag.objects.bulk_create(
+            Tag(name=slug, slug=slug, color=color) for slug, color in (
+                ('breakfast', '#E26C2D'), ('lunch', '#49B64E'),
+                ('dinner', '#8775D2'),
+            )
+        )
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        password = make_password('benchmark')
+        User.objects.bulk_create(
+            User(email=f'user{number}@example.com', username=f'user{number}',
+                 first_name='Bench', last_name=f'User {number}',
+                 password=password)
+            for number in range(options['users'])
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        self.user = User.objects.get(pk=user_ids[0])
+
+        Recipe.objects.bulk_create(
+            (
+                Recipe(author_id=rng.choice(user_ids), name=f'Recipe {number}',
+                       text=f'Synthetic recipe number {number}.',
+                       cooking_time=rng.randint(5, 120))
+                for number in range(options['recipes'])
+            ),
+            batch_size=1000
+        )
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in rng.sample(tag_ids, rng.randint(1, len(tag_ids)))
+            ),
+            batch_size=1000
+        )
+        IngredientInRecipe.objects.bulk_create(
+            (
+                IngredientInRecipe(recipe_id=recipe_id,
+                                   ingredient_id=ingredient_id,
+                                   amount=rng.randint(1, 500))
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(ingredient_ids,
+                                                rng.randint(5, 30))
+            ),
+            batch_size=1000
+        )
+        self.link(Follow, 'author_id', user_ids, user_ids, options['follows'])
+        self.link(Favorite, 'recipe_id', user_ids, recipe_ids,
+                  options['favorites'])
+        self.link(PurchaseList, 'recipe_id', user_ids, recipe_ids,
+                  options['cart'])
+
+        call_command('recount', stdout=StringIO())
+        rebuild_cart_totals(user_ids)
+        update_search_vectors(Recipe.objects.all())
+        for user in User.objects.all():
+            backfill_feed(user, user.follower.values_list('author_id',
+                                                          flat=True))
+        self.recipe_id = recipe_ids[0]
+        self.ingredient_ids = ingredient_ids
+
+    def link(self, model, field, user_ids, target_ids, count):
+        """Link every user to ``count`` random targets."""
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{field: target_id})
+                for user_id in user_ids
+                for target_id in self.rng.sample(
+                    target_ids, min(count, len(target_ids))
+                )
+                if model is not Follow or user_id != target_id
+            ),
+            batch_size=1000
+        )
+
+    def recipe_data(self):
+        ingredients = self.rng.sample(self.ingredient_ids, 10)
+        return {
+            'name': 'Benchmark recipe',
+            'text': 'Created by the benchmark.',
+            'cooking_time': 30,
+            'image': IMAGE,
+            'tags': list(Tag.objects.values_list('id', flat=True)[:2]),
+            'ingredients': [
+                {'id': ingredient_id, 'amount': self.rng.randint(1, 500)}
+                for ingredient_id in ingredients
+            ],
+        }
+
+    def scenarios(self):
+        """Return ``(name, method, url, data, authenticated)`` tuples."""
+        recipe = f'/api/recipes/{self.recipe_id}/'
+        updated = Recipe.objects.filter(author=self.user).first()
+        ingredient = Ingredient.objects.order_by('name').first().name[:3]
+        return [
+            ('recipes-list', 'get', '/api/recipes/', None, True),
+            ('recipes-list-anonymous', 'get', '/api/recipes/', None, False),
+            ('recipes-list-cursor', 'get', '/api/recipes/?pagination=cursor',
+             None, True),
+            ('recipes-detail', 'get', recipe, None, True),
+            ('recipes-search', 'get', '/api/recipes/?search=recipe', None,
+             True),
+            ('recipes-feed', 'get', '/api/recipes/feed/', None, True),
+            ('users-subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None, True),
+            ('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/', None, True),
+            ('ingredients-search', 'get',
+             f'/api/ingredients/?name={ingredient}', None, False),
+            ('recipes-create', 'post', '/api/recipes/', self.recipe_data,
+             True),
+            ('recipes-update', 'put', f'/api/recipes/{updated.id}/',
+             self.recipe_data, True),
+        ]
+
+    def request(self, client, method, url, data):
+        response = getattr(client, method)(
+            url, data() if data else None, format='json'
+        )
+        if response.streaming:
+            body = b''.join(response.streaming_content)
+        else:
+            body = response.content
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f'{method.upper()} {url}: {response.status_code} {body[:200]}'
+            )
+        return body
+
+    def run_scenarios(self, repeat):
+        """Measure every scenario twice: ``cold`` clears the Django cache
+        before each request, so no cached response, version counter or
+        index built from one is reused, as without any caching; ``warm``
+        keeps it, as a busy server serving the same pages would."""
+        user_client = APIClient()
+        user_client.force_authenticate(self.user)
+        anonymous_client = APIClient()
+        results = {}
+        for name, method, url, data, authenticated in self.scenarios():
+            client = user_client if authenticated else anonymous_client
+            results[name] = {
+                state: self.measure(client, method, url, data, repeat,
+                                    cold=state == 'cold')
+                for state in ('cold', 'warm')
+            }
+            self.stderr.write(f'{name}: ' + '; '.join(
+                f'{state} {result["median_ms"]} ms, '
+                f'{result["queries"]} queries'
+                for state, result in results[name].items()
+            ))
+        return results
+
+    def measure(self, client, method, url, data, repeat, cold):
+        self.request(client, method, url, data)
+        timings = []
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                body = self.request(client, method, url, data)
+                timings.append(time.perf_counter() - started)
+            query_count = len(queries)
+        if cold:
+            cache.clear()
+        tracemalloc.start()
+        self.request(client, method, url, data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return self.summary(timings, query_count, len(body), peak)
+
+    def server_scenarios(self):
+        """Return ``(name, url)`` of the endpoints with an async copy."""
+        ingredient = Ingredient.objects.order_by('name').first().name[:3]
+        return [
+            ('recipes-list', '/api/recipes/'),
+            ('recipes-detail', f'/api/recipes/{self.recipe_id}/'),
+            ('recipes-download-shopping-cart',
+             '/api/recipes/download_shopping_cart/'),
+            ('tags-list', '/api/tags/'),
+            ('ingredients-search', f'/api/ingredients/?name={ingredient}'),
+        ]
+
+    def compare_servers(self, repeat, concurrency):
+        """Run ``repeat`` rounds of ``concurrency`` parallel requests
+        against the sync views through the WSGI handler, from as many
+        threads, and against their ``/api/async/`` copies through the ASGI
+        handler, from one event loop with as many executor threads. The
+        cache stays warm.
+        """
+        token = Token.objects.get_or_create(user=self.user)[0].key
+        results = {}
+        for name, url in self.server_scenarios():
+            async_url = url.replace('/api/', '/api/async/', 1)
+            results[name] = {
+                'wsgi': self.run_wsgi(url, token, repeat, concurrency),
+                'asgi': asyncio.run(
+                    self.run_asgi(async_url, token, repeat, concurrency)
+                ),
+            }
+            self.stderr.write(
+                f'{name} x{concurrency}: '
+                f'wsgi {results[name]["wsgi"]["requests_per_second"]} req/s, '
+                f'asgi {results[name]["asgi"]["requests_per_second"]} req/s'
+            )
+        return results
+
+    def check_response(self, url, response):
+        if response.status_code >= 400:
+            raise RuntimeError(
+                f'GET {url}: {response.status_code} {response.content[:200]}'
+            )
+
+    def run_wsgi(self, url, token, repeat, concurrency):
+        clients = local()
+
+        def get(_):
+            if not hasattr(clients, 'client'):
+                clients.client = Client(HTTP_AUTHORIZATION=f'Token {token}')
+            started = time.perf_counter()
+            response = clients.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            self.check_response(url, response)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(get, range(concurrency)))
+            started = time.perf_counter()
+            timings = list(pool.map(get, range(repeat * concurrency)))
+            elapsed = time.perf_counter() - started
+            self.close_connections(pool, concurrency)
+        return self.server_summary(timings, elapsed)
+
+    async def run_asgi(self, url, token, repeat, concurrency):
+        pool = ThreadPoolExecutor(concurrency)
+        asyncio.get_running_loop().set_default_executor(pool)
+        client = AsyncClient()
+
+        async def get():
+            started = time.perf_counter()
+            response = await client.get(url, authorization=f'Token {token}')
+            if response.streaming:
+                # As the ASGI handler reads it, chunk by chunk off the loop.
+                b''.join([chunk async for chunk in response])
+            self.check_response(url, response)
+            return time.perf_counter() - started
+
+        await asyncio.gather(*(get() for _ in range(concurrency)))
+        timings = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            timings.extend(
+                await asyncio.gather(*(get() for _ in range(concurrency)))
+            )
+        elapsed = time.perf_counter() - started
+        self.close_connections(pool, concurrency)
+        return self.server_summary(timings, elapsed)
+
+    def close_connections(self, pool, size):
+        """Close the database connections of every thread of the pool, so
+        the test database can be dropped afterwards."""
+        barrier = Barrier(size)
+
+        def close(_):
+            barrier.wait()
+            connections.close_all()
+
+        list(pool.map(close, range(size)))
+
+    def server_summary(self, timings, elapsed):
+        return {
+            **self.timing_summary(timings),
+            'requests_per_second': round(len(timings) / elapsed, 1),
+        }
+
+    def summary(self, timings, queries, size, peak):
+        return {
+            'queries': queries,
+            'response_bytes': size,
+            'peak_memory_bytes': peak,
+            **self.timing_summary(timings),
+        }
+
+    def timing_summary(self, timings):
+        timings = sorted(timing * 1000 for timing in timings)
+        return {
+            'min_ms': round(timings[0], 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(timings[int(0.95 * (len(timings) - 1))], 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+        }
@@ -0,0 +1,134 @@
+import heapq
+import logging
+from array import array
+from collections import Counter
+from threading import Lock, Thread
+
+from django.db import connections
+from django.db.models import Max
+
+from recipes.models import IngredientInRecipe
+from .caching import get_version
+
+logger = logging.getLogger(__name__)
+
+EMPTY = array('I')
+
+
+class Matches:
+    """Recipes matching a set of ingredients, best coverage first.
+
+    Only as many recipes as the pages asked for need are ranked, with a
+    partial heap sort over the candidates, and the ranking is kept for
+    the later slices of the same query.
+    """
+
+    def __init__(self, matched, sizes):
+        self.matched = matched
+        self.sizes = sizes
+        self.best = []
+
+    def __len__(self):
+        return len(self.matched)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(len(self))
+        if stop > len(self.best):
+            sizes = self.sizes
+            self.best = heapq.nlargest(stop, (
+                (count / sizes[recipe_id], count, recipe_id)
+                for recipe_id, count in self.matched.items()
+            ))
+        return [
+            (recipe_id, count, coverage)
+            for coverage, count, recipe_id in self.best[start:stop]
+        ]
+
+
+class RecipeMatchIndex:
+    """In-process inverted index from ingredients to the recipes using them.
+
+    Every ingredient maps to the sorted ids of its recipes, kept in a
+    compact ``array``, and the ingredient count of every recipe is kept in
+    an array indexed by recipe id. The index is rebuilt once the
+    ``recipe-ingredients`` version changes: the first build blocks, later
+    ones run in a background thread while the previous index is served.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.data = None
+
+    def refresh(self):
+        version = get_version('recipe-ingredients')
+        if version == self.version:
+            return
+        if self.data is None:
+            with self.lock:
+                if self.data is None:
+                    self.build(version)
+            return
+        if self.lock.acquire(blocking=False):
+            Thread(
+                target=self.rebuild, args=(version,), daemon=True,
+                name='recipe-match-index'
+            ).start()
+
+    def rebuild(self, version):
+        try:
+            self.build(version)
+        except Exception:
+            logger.exception('Could not rebuild the recipe match index')
+        finally:
+            self.lock.release()
+            connections.close_all()
+
+    def build(self, version):
+        max_id = IngredientInRecipe.objects.aggregate(
+            max_id=Max('recipe_id')
+        )['max_id'] or 0
+        typecode = 'I' if max_id < 2 ** 32 else 'Q'
+        postings = {}
+        sizes = array('H', bytes(2 * (max_id + 1)))
+        rows = IngredientInRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator(chunk_size=10000):
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array(typecode)
+            posting.append(recipe_id)
+            if recipe_id >= len(sizes):
+                # A recipe created after the maximum id was read.
+                sizes.frombytes(bytes(2 * (recipe_id + 1 - len(sizes))))
+            sizes[recipe_id] += 1
+        self.data = (postings, sizes)
+        self.version = version
+
+    def match(self, ingredient_ids, require_all=False):
+        """Return the recipes using any of the ingredients as
+        ``(recipe_id, matched, coverage)`` items; with ``require_all``,
+        only the recipes that can be cooked from the given ingredients
+        alone, that is with a coverage of 1.
+
+        Coverage is the share of a recipe's ingredients found among the
+        given ones; ties go to the recipe with more matches, then to the
+        newest one.
+        """
+        self.refresh()
+        postings, sizes = self.data
+        matched = Counter()
+        for ingredient_id in set(ingredient_ids):
+            matched.update(postings.get(ingredient_id, EMPTY))
+        if require_all:
+            matched = {
+                recipe_id: count for recipe_id, count in matched.items()
+                if count == sizes[recipe_id]
+            }
+        return Matches(matched, sizes)
+
+
+recipe_match_index = RecipeMatchIndex()
@@ -0,0 +1,229 @@
+import logging
+import re
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+from threading import Lock
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS = (
+    ('request_duration_seconds', 'Total time spent on a request.'),
+    ('db_queries', 'SQL queries run by a request.'),
+    ('db_duration_seconds', 'Time spent waiting for the database.'),
+    ('serializer_duration_seconds',
+     'Time spent in the view outside of the database, mostly serializers.'),
+    ('render_duration_seconds', 'Time spent rendering the response.'),
+    ('response_size_bytes', 'Size of the response body.'),
+)
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def fingerprint(sql):
+    """Normalize a query so the same statement with other parameters or
+    another number of ``IN`` values gives the same fingerprint."""
+    return WHITESPACE.sub(' ', IN_LIST.sub('(...)', sql)).strip()
+
+
+class QueryRecorder:
+    """Database execute wrapper counting the queries of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        return [
+            (sql, count) for sql, count in self.fingerprints.most_common()
+            if count > 1
+        ]
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper of every connection, passing the query to the
+    recorder of the current request.
+
+    The recorder is found through a context variable rather than installed
+    on the connections of one thread, so queries of views offloaded to
+    other threads under ASGI are counted too.
+    """
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RouteMetrics:
+    """Rolling samples of the latest ``METRICS_WINDOW`` requests of every
+    route, plus lifetime sums and counts."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.samples = defaultdict(
+            lambda: deque(maxlen=settings.METRICS_WINDOW)
+        )
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def observe(self, route, name, value):
+        with self.lock:
+            self.samples[route, name].append(value)
+            self.sums[route, name] += value
+            self.counts[route, name] += 1
+
+    def quantiles(self, route, name):
+        with self.lock:
+            values = sorted(self.samples[route, name])
+        if not values:
+            return []
+        last = len(values) - 1
+        return [
+            (quantile, values[min(last, int(quantile * len(values)))])
+            for quantile in QUANTILES
+        ]
+
+    def render_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            keys = sorted(self.counts)
+        lines = []
+        for name, help_text in METRICS:
+            metric = f'foodgram_{name}'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} summary')
+            for route, key in keys:
+                if key != name:
+                    continue
+                label = f'route="{route}"'
+                for quantile, value in self.quantiles(route, name):
+                    lines.append(
+                        f'{metric}{{{label},quantile="{quantile}"}} {value}'
+                    )
+                lines.append(f'{metric}_sum{{{label}}} '
+                             f'{self.sums[route, name]}')
+                lines.append(f'{metric}_count{{{label}}} '
+                             f'{self.counts[route, name]}')
+        return '\n'.join(lines) + '\n'
+
+
+route_metrics = RouteMetrics()
+
+
+class MetricsMiddleware:
+    """Record query count, database time, view and render time and the
+    response size of every API request, per DRF route name.
+
+    Requests slower than ``SLOW_REQUEST_THRESHOLD`` seconds are logged
+    with the queries they ran more than once, the usual sign of N+1.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            # Mark the instance as a coroutine function, as Django's
+            # MiddlewareMixin does, so the handler calls it without a thread.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        request.metrics = {'recorder': recorder}
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        duration = time.perf_counter() - start
+        self.record(request, response, recorder, duration)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        request.metrics = {'recorder': recorder}
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        duration = time.perf_counter() - start
+        self.record(request, response, recorder, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            metrics['view_start'] = time.perf_counter()
+            metrics['view_db'] = metrics['recorder'].duration
+
+    def process_template_response(self, request, response):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is None or 'view_start' not in metrics:
+            return response
+        now = time.perf_counter()
+        metrics['view_time'] = now - metrics['view_start'] - (
+            metrics['recorder'].duration - metrics['view_db']
+        )
+
+        def rendered(response):
+            metrics['render_time'] = time.perf_counter() - now
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, recorder, duration):
+        match = request.resolver_match
+        if match is None or not match.url_name:
+            return
+        route = match.url_name
+        observe = route_metrics.observe
+        observe(route, 'request_duration_seconds', duration)
+        observe(route, 'db_queries', recorder.count)
+        observe(route, 'db_duration_seconds', recorder.duration)
+        if 'view_time' in request.metrics:
+            observe(route, 'serializer_duration_seconds',
+                    request.metrics['view_time'])
+        if 'render_time' in request.metrics:
+            observe(route, 'render_duration_seconds',
+                    request.metrics['render_time'])
+        if not response.streaming:
+            observe(route, 'response_size_bytes', len(response.content))
+        if duration >= settings.SLOW_REQUEST_THRESHOLD:
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs, %d queries in %.3fs, '
+                'duplicated queries: %s',
+                request.method, request.get_full_path(), route, duration,
+                recorder.count, recorder.duration,
+                recorder.duplicates()[:5] or 'none'
+            )
@@ -0,0 +1,172 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from foodgram.routers import reading_from_replica
+from recipes.models import Recipe
+from recipes.services import user_recipe_flags
+from .caching import get_version
+
+
+class VersionedCacheMixin:
+    """Conditional GET support for rarely changing read-only endpoints.
+
+    Responses carry a strong ETag built from the change counter named by
+    ``cache_version_name``, so unchanged data is answered with 304.
+    Rendered JSON bodies are kept in a small per-process LRU keyed by the
+    counter and the full path, so the serializer only runs again after
+    the data changes.
+    """
+    cache_version_name = None
+    cache_size = 1024
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.cached_bodies = OrderedDict()
+        cls.cached_bodies_lock = Lock()
+
+    def get_etag(self):
+        version = get_version(self.cache_version_name)
+        return f'"{self.cache_version_name}-{version}"'
+
+    def finalize_cached(self, response, etag):
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_DATA_MAX_AGE
+        )
+        return response
+
+    def cached_response(self, request, render):
+        etag = self.get_etag()
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            if '*' in etags or etag in etags:
+                return self.finalize_cached(HttpResponseNotModified(), etag)
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            return self.finalize_cached(render(), etag)
+
+        key = (etag, request.get_full_path())
+        with self.cached_bodies_lock:
+            body = self.cached_bodies.get(key)
+            if body is not None:
+                self.cached_bodies.move_to_end(key)
+        if body is None:
+            response = render()
+            if response.status_code != 200:
+                return response
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            body = response.rendered_content
+            with self.cached_bodies_lock:
+                self.cached_bodies[key] = body
+                while len(self.cached_bodies) > self.cache_size:
+                    self.cached_bodies.popitem(last=False)
+        return self.finalize_cached(
+            HttpResponse(body, content_type='application/json'), etag
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(VersionedCacheMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(VersionedCacheMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+
+class RecipeListCacheMixin:
+    """Shared cache of recipe list pages with per-user flags on top.
+
+    Pages are cached in the Django cache as serialized for a user with no
+    favorites, cart or subscriptions, keyed by the normalized query and
+    the ``recipes``, ``tags`` and ``ingredients`` change counters. For an
+    authenticated user the flags of the page are read with one query and
+    laid over a copy of the cached page. Queries with parameters outside
+    ``list_cache_params`` are not cached.
+    """
+    list_cache_versions = ('recipes', 'tags', 'ingredients')
+    list_cache_params = {'page', 'limit', 'tags', 'author', 'ordering',
+                         'search', 'pagination', 'cursor'}
+    shared_list = False
+
+    def get_list_cache_key(self, request):
+        params = request.query_params
+        if not set(params) <= self.list_cache_params:
+            return None
+        query = urlencode(sorted(
+            (name, value) for name in params
+            for value in params.getlist(name)
+        ))
+        url = request.build_absolute_uri(request.path)
+        versions = '.'.join(
+            str(get_version(name)) for name in self.list_cache_versions
+        )
+        digest = hashlib.md5(f'{url}?{query}'.encode()).hexdigest()
+        return f'api:recipe-list:{versions}:{digest}'
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_list_cache_key(request)
+        if key is None:
+            return super().list(request, *args, **kwargs)
+        data = cache.get(key)
+        if data is None:
+            self.shared_list = True
+            response = super().list(request, *args, **kwargs)
+            self.shared_list = False
+            if response.status_code != 200:
+                return response
+            data = response.data
+            timeout = settings.RECIPE_LIST_CACHE_TIMEOUT
+            if reading_from_replica():
+                # The replica may still lag behind the change counters.
+                timeout = min(timeout, settings.REPLICA_PIN_SECONDS)
+            cache.set(key, data, timeout)
+        if request.user.is_authenticated:
+            data = self.add_user_flags(data, request.user)
+        return Response(data)
+
+    def add_user_flags(self, data, user):
+        results = data['results'] if isinstance(data, dict) else data
+        flags = {
+            pk: (is_favorited, is_in_shopping_cart, author_is_subscribed)
+            for pk, is_favorited, is_in_shopping_cart, author_is_subscribed
+            in Recipe.objects.filter(
+                pk__in=[recipe['id'] for recipe in results]
+            ).annotate(**user_recipe_flags(user)).values_list(
+                'pk', 'is_favorited', 'is_in_shopping_cart',
+                'author_is_subscribed'
+            )
+        }
+        recipes = []
+        for recipe in results:
+            is_favorited, is_in_shopping_cart, author_is_subscribed = (
+                flags.get(recipe['id'], (False, False, False))
+            )
+            recipes.append({
+                **recipe,
+                'is_favorited': is_favorited,
+                'is_in_shopping_cart': is_in_shopping_cart,
+                'author': {
+                    **recipe['author'], 'is_subscribed': author_is_subscribed
+                },
+            })
+        if isinstance(data, dict):
+            return {**data, 'results': recipes}
+        return recipes
@@ -1,5 +1,199 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.models import MAX_ID
+from recipes.services import get_feed_sources
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that trusts the planner statistics for big, unfiltered
+    Postgres tables instead of running ``COUNT(*)``."""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where and not query.distinct:
+            estimate = self.estimate_count()
+            if estimate >= settings.APPROXIMATE_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+    def estimate_count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else 0
 
 
 class PageNumberPaginatorModified(PageNumberPagination):
     page_size_query_param = 'limit'
+    django_paginator_class = EstimatedCountPaginator
+
+
+class KeysetPagination(BasePagination):
+    """Keyset pagination over ``(pub_date, id)``, newest first.
+
+    Every page is a range scan starting right after the opaque cursor,
+    so deep pages cost the same as the first one. No total count is
+    computed.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param, '')
+        if page_size.isdigit() and int(page_size) > 0:
+            return min(int(page_size), self.max_page_size)
+        return settings.REST_FRAMEWORK['PAGE_SIZE']
+
+    def encode_cursor(self, recipe, reverse):
+        position = json.dumps({
+            'd': recipe.pub_date.isoformat(),
+            'i': recipe.id,
+            'r': int(reverse),
+        })
+        cursor = urlsafe_b64encode(position.encode()).decode()
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, cursor
+        )
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(cursor.encode()))
+            pub_date = parse_datetime(position['d'])
+            pk = int(position['i'])
+            if pub_date is None or not 0 < pk <= MAX_ID:
+                raise ValueError
+            return pub_date, pk, bool(position['r'])
+        except (TypeError, ValueError, KeyError):
+            raise ValidationError({
+                self.cursor_query_param: ['Invalid cursor']
+            })
+
+    def seek(self, queryset, cursor, date_field='pub_date', id_field='id'):
+        """Order ``queryset`` newest first and skip the rows up to the
+        cursor, oldest first when paging backwards."""
+        if cursor is None:
+            return queryset.order_by(f'-{date_field}', f'-{id_field}')
+        pub_date, pk, reverse = cursor
+        # The redundant bound on the date alone lets the database read the
+        # rows with one ordered index range scan instead of a bitmap OR.
+        if reverse:
+            return queryset.filter(
+                Q(**{f'{date_field}__gt': pub_date})
+                | Q(**{date_field: pub_date, f'{id_field}__gt': pk}),
+                **{f'{date_field}__gte': pub_date}
+            ).order_by(date_field, id_field)
+        return queryset.filter(
+            Q(**{f'{date_field}__lt': pub_date})
+            | Q(**{date_field: pub_date, f'{id_field}__lt': pk}),
+            **{f'{date_field}__lte': pub_date}
+        ).order_by(f'-{date_field}', f'-{id_field}')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        results = list(self.seek(queryset, cursor)[:page_size + 1])
+        return self.paginate_results(results, page_size, cursor)
+
+    def paginate_results(self, results, page_size, cursor):
+        """Keep one page of ``results``, fetched one row past the page to
+        tell whether there are more."""
+        reverse = cursor is not None and cursor[2]
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class FeedPagination(KeysetPagination):
+    """Keyset pagination over the feed of the requesting user.
+
+    Every source of the feed, see ``get_feed_sources``, is read with one
+    index range scan of a page and a row past it. The rows are merged and
+    only the recipes of the resulting page are loaded. Rows dropped by the
+    filters of the queryset are made up for with further, growing batches
+    read past the last merged row, until the page is full or the feed
+    runs out.
+    """
+    max_batch_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[2]
+        sources = get_feed_sources(request.user)
+        results = []
+        position = cursor
+        batch_size = page_size + 1
+        while len(results) <= page_size:
+            rows = self.read_sources(sources, position, batch_size, reverse)
+            recipes = queryset.in_bulk([pk for _, pk in rows])
+            results.extend(recipes[pk] for _, pk in rows if pk in recipes)
+            if len(rows) < batch_size:
+                break
+            position = (*rows[-1], reverse)
+            batch_size = min(batch_size * 2, self.max_batch_size)
+        return self.paginate_results(
+            results[:page_size + 1], page_size, cursor
+        )
+
+    def read_sources(self, sources, cursor, limit, reverse):
+        """Return the first ``limit`` ``(pub_date, recipe_id)`` rows of the
+        merged sources past the cursor."""
+        rows = set()
+        for source, date_field, id_field in sources:
+            rows.update(self.seek(source, cursor, date_field, id_field)
+                        .values_list(date_field, id_field)[:limit])
+        return sorted(rows, reverse=not reverse)[:limit]
@@ -10,4 +10,4 @@ class IsOwnerOrAdminOrReadOnly(BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in SAFE_METHODS or request.user.is_superuser:
             return True
-        return request.user == obj.author
+        return request.user.id == obj.author_id
@@ -0,0 +1,99 @@
+import csv
+import io
+import os
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from recipes.units import format_amount
+
+
+class Echo:
+    """File-like object that hands back whatever is written to it."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Base class for the shopping list download formats.
+
+    Every format defines ``stream(rows)``, a generator of the encoded
+    chunks of the list; ``render()`` is only used by DRF for error
+    responses of the download endpoint.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return JSONRenderer().render(data)
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        for row in rows:
+            amount = format_amount(row['total_amount'],
+                                   row['measurement_unit'])
+            yield f'{row["name"]} - {amount}\n'.encode(self.charset)
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ['name', 'amount', 'measurement_unit']
+        ).encode(self.charset)
+        for row in rows:
+            yield writer.writerow([
+                row['name'], row['total_amount'], row['measurement_unit']
+            ]).encode(self.charset)
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+    chunk_size = 64 * 1024
+    line_height = 18
+    margin = 50
+
+    def get_font(self):
+        font_path = getattr(settings, 'SHOPPING_LIST_PDF_FONT', None)
+        if not font_path or not os.path.exists(font_path):
+            return 'Helvetica'
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        return self.font_name
+
+    def stream(self, rows):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        _, height = A4
+        y = height - self.margin
+        pdf.setFont(font, 14)
+        pdf.drawString(self.margin, y, 'Shopping list')
+        y -= self.line_height * 2
+        pdf.setFont(font, 12)
+        for row in rows:
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, 12)
+                y = height - self.margin
+            amount = format_amount(row['total_amount'],
+                                   row['measurement_unit'])
+            pdf.drawString(self.margin, y, f'• {row["name"]} - {amount}')
+            y -= self.line_height
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(self.chunk_size), b'')
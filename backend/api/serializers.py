@@ -1,11 +1,20 @@
-from django.shortcuts import get_object_or_404
+from django.db import transaction
 from rest_framework import serializers
 
-from drf_extra_fields.fields import Base64ImageField
-
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+from recipes.models import (MAX_ID, Favorite, Ingredient, IngredientInRecipe,
                             PurchaseList, Recipe, Follow, Tag, User)
+from recipes.services import (schedule_search_update, tags_mask,
+                              update_carts_of_recipe)
 from users.serializers import UserSerializer
+from .caching import bump_version
+from .fields import ImageSrcsetField, RecipeImageField, ThumbnailField
+
+
+MAX_AMOUNT = 2 ** 31 - 1
+
+
+def recipe_ingredients_changed():
+    bump_version('recipe-ingredients')
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -34,9 +43,18 @@ class AddIngredientToRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'amount', 'measurement_unit')
 
 
+class IngredientAmountSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    amount = serializers.IntegerField(
+        min_value=1, max_value=MAX_AMOUNT,
+        error_messages={'min_value': 'Amount can not be a negative number.'}
+    )
+
+
 class CreateRecipeSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    image = Base64ImageField(max_length=None, use_url=True)
+    image = RecipeImageField(max_length=None, use_url=True)
+    image_srcset = ImageSrcsetField()
     tags = TagSerializer(many=True, read_only=True)
     ingredients = AddIngredientToRecipeSerializer(
         source='ingredients_amounts', many=True, read_only=True,)
@@ -45,76 +63,158 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
+                  'is_in_shopping_cart', 'name', 'image', 'image_srcset',
+                  'text', 'cooking_time', 'pub_date')
         read_only_fields = ('author',)
 
     def validate(self, data):
         ingredients = self.initial_data.get('ingredients')
-        ingredients_set = set()
+        ingredients_amounts = {}
         if ingredients is None:
             raise serializers.ValidationError({
                 'ingredients': ('Please add some ingredients')
             })
+        ingredients = self.validate_input(
+            'ingredients', IngredientAmountSerializer(many=True), ingredients
+        )
         for ingredient in ingredients:
-            if int(ingredient.get('amount')) <= 0:
-                raise serializers.ValidationError(
-                    ('Amount can not be a negative number.')
-                )
-            id = ingredient.get('id')
-            if id in ingredients_set:
+            id = ingredient['id']
+            if id in ingredients_amounts:
                 raise serializers.ValidationError(
                     'Please make sure your ingredients are not '
                     'dublicated.'
                 )
-            ingredients_set.add(id)
-        data['ingredients'] = ingredients
+            ingredients_amounts[id] = ingredient['amount']
+        existing_ingredients = Ingredient.objects.filter(
+            id__in=ingredients_amounts
+        ).values_list('id', flat=True)
+        if len(existing_ingredients) != len(ingredients_amounts):
+            raise serializers.ValidationError({
+                'ingredients': ('Some of the ingredients do not exist.')
+            })
+        tags = self.initial_data.get('tags')
+        if tags is None:
+            raise serializers.ValidationError({
+                'tags': ('Please add some tags')
+            })
+        tags = set(self.validate_input('tags', serializers.ListField(
+            child=serializers.IntegerField(min_value=1, max_value=MAX_ID)
+        ), tags))
+        if Tag.objects.filter(id__in=tags).count() != len(tags):
+            raise serializers.ValidationError({
+                'tags': ('Some of the tags do not exist.')
+            })
+        data['ingredients'] = ingredients_amounts
+        data['tags'] = tags
 
         return data
 
-    def create_or_update(self, ingredients_list, recipes_list):
-        for ingredient in ingredients_list:
-            IngredientInRecipe.objects.create(
-                recipe=recipes_list,
-                ingredient_id=ingredient.get('id'),
-                amount=ingredient.get('amount')
+    def validate_input(self, field_name, field, value):
+        """Validate a raw input value of the write-only ``field_name``,
+        reporting errors under its name."""
+        try:
+            return field.run_validation(value)
+        except serializers.ValidationError as error:
+            raise serializers.ValidationError({field_name: error.detail})
+
+    def create_ingredients(self, recipe, ingredients):
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
             )
-
+            for ingredient_id, amount in ingredients.items()
+        )
+
+    def update_ingredients(self, recipe, ingredients):
+        """Write the new ingredient amounts of a recipe and return the
+        ``{ingredient_id: (amount, recipes_count)}`` changes for the carts
+        holding it."""
+        current = {
+            ingredient_amount.ingredient_id: ingredient_amount
+            for ingredient_amount in IngredientInRecipe.objects.filter(
+                recipe=recipe
+            )
+        }
+        removed = [
+            ingredient_amount.id
+            for ingredient_id, ingredient_amount in current.items()
+            if ingredient_id not in ingredients
+        ]
+        cart_changes = {
+            ingredient_id: (-ingredient_amount.amount, -1)
+            for ingredient_id, ingredient_amount in current.items()
+            if ingredient_id not in ingredients
+        }
+        changed = []
+        for ingredient_id, amount in ingredients.items():
+            ingredient_amount = current.get(ingredient_id)
+            if ingredient_amount is None:
+                cart_changes[ingredient_id] = (amount, 1)
+            elif ingredient_amount.amount != amount:
+                cart_changes[ingredient_id] = (
+                    amount - ingredient_amount.amount, 0
+                )
+                ingredient_amount.amount = amount
+                changed.append(ingredient_amount)
+        if removed:
+            IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        self.create_ingredients(recipe, {
+            ingredient_id: amount
+            for ingredient_id, amount in ingredients.items()
+            if ingredient_id not in current
+        })
+        return cart_changes
+
+    @transaction.atomic
     def create(self, validated_data):
-        image = validated_data.pop('image')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(image=image, **validated_data)
-        tags = self.initial_data.get('tags')
+        tags = validated_data.pop('tags')
+        recipe = Recipe.objects.create(
+            tags_mask=tags_mask(tags), **validated_data
+        )
         recipe.tags.set(tags)
-        self.create_or_update(ingredients, recipe)
+        self.create_ingredients(recipe, ingredients)
+        schedule_search_update(recipe.pk)
+        transaction.on_commit(recipe_ingredients_changed)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        tags = self.initial_data.get('tags')
-        for tag_id in tags:
-            instance.tags.add(get_object_or_404(Tag, pk=tag_id))
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        for ingredient in validated_data.get('ingredients'):
-            ingredients_amounts = IngredientInRecipe.objects.create(
-                recipe=instance,
-                ingredient_id=ingredient.get('id'),
-                amount=ingredient.get('amount')
-            )
-            ingredients_amounts.save()
-        instance.image = validated_data.get('image')
-        instance.name = validated_data.get('name')
-        instance.text = validated_data.get('text')
-        instance.cooking_time = validated_data.get('cooking_time')
-        instance.save()
-        return instance
+        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
+        instance.tags.set(tags)
+        instance.tags_mask = tags_mask(tags)
+        cart_changes = self.update_ingredients(instance, ingredients)
+        schedule_search_update(instance.pk)
+        recipe = super().update(instance, validated_data)
+        # Applied once saving the recipe has locked its row, which adding
+        # it to a cart locks too, so cart changes are never missed.
+        update_carts_of_recipe(recipe.pk, cart_changes)
+        # The match index only holds which ingredients recipes use, so new
+        # amounts alone do not rebuild it.
+        if any(count for _, count in cart_changes.values()):
+            transaction.on_commit(recipe_ingredients_changed)
+        return recipe
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
         return Favorite.objects.filter(user=request.user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
@@ -125,70 +225,49 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
-
-
-class FavoriteSerializer(serializers.ModelSerializer):
-    recipe = serializers.PrimaryKeyRelatedField(queryset=Recipe.objects.all())
-    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    image = ThumbnailField()
+    image_srcset = ImageSrcsetField()
 
     class Meta:
-        model = Favorite
-        fields = ('user', 'recipe')
+        model = Recipe
+        fields = ['id', 'name', 'image', 'image_srcset', 'cooking_time']
 
-    def validate(self, data):
-        request = self.context.get('request')
-        recipe_id = data['recipe'].id
-        favorite_exists = Favorite.objects.filter(
-            user=request.user,
-            recipe__id=recipe_id
-        ).exists()
 
-        if request.method == 'GET' and favorite_exists:
-            raise serializers.ValidationError(
-                'Recipe is already in favorites'
-            )
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
 
-        return data
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
 
-    def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
-        return FollowRecipeSerializer(
-            instance.recipe,
-            context=context).data
 
+class RecipeMatchQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100
+    )
+    require_all = serializers.BooleanField(default=False)
 
-class PurchaseListSerializer(serializers.ModelSerializer):
 
-    class Meta:
-        model = PurchaseList
-        fields = '__all__'
+class RecipeMatchSerializer(CreateRecipeSerializer):
+    matched = serializers.IntegerField(read_only=True)
+    coverage = serializers.FloatField(read_only=True)
 
-    def validate(self, attrs):
-        request = self.context['request']
-        if (request.method == 'GET'
-                and PurchaseList.objects.filter(
-                    user=request.user,
-                    recipe=attrs['recipe'])):
-            raise serializers.ValidationError(
-                'Recipe is already added to purchase list'
-            )
-        return attrs
-
-    def to_representation(self, instance):
-        return RecipeShortSerializer(
-            instance.recipe,
-            context={'request': self.context.get('request')}
-        ).data
+    class Meta(CreateRecipeSerializer.Meta):
+        fields = CreateRecipeSerializer.Meta.fields + ('matched', 'coverage')
 
 
 class FollowRecipeSerializer(serializers.ModelSerializer):
+    image = ThumbnailField()
+    image_srcset = ImageSrcsetField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_srcset', 'cooking_time')
 
 
 class FollowerSerializer(serializers.ModelSerializer):
@@ -199,7 +278,7 @@ class FollowerSerializer(serializers.ModelSerializer):
     last_name = serializers.ReadOnlyField(source='author.last_name')
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField(source='author.recipes_count')
 
     class Meta:
         model = User
@@ -210,44 +289,15 @@ class FollowerSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
+        if obj.user_id == request.user.id:
+            return True
         return Follow.objects.filter(
-            user=obj.user, author=obj.author
+            user=request.user, author=obj.author
         ).exists()
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        queryset = Recipe.objects.filter(author=obj.author)
-        if limit is not None:
-            queryset = Recipe.objects.filter(
-                author=obj.author
-            )[:int(limit)]
-
-        return FollowRecipeSerializer(queryset, many=True).data
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
-
-
-class FollowSerializer(serializers.ModelSerializer):
-    queryset = User.objects.all()
-    user = serializers.PrimaryKeyRelatedField(queryset=queryset)
-    author = serializers.PrimaryKeyRelatedField(queryset=queryset)
-
-    class Meta:
-        model = Follow
-        fields = ('user', 'author')
-
-    def validate(self, attrs):
-        request = self.context['request']
-        if request.method == 'GET':
-            if request.user == attrs['author']:
-                raise serializers.ValidationError(
-                    'You can not subscribe to yourself'
-                )
-            if Follow.objects.filter(
-                    user=request.user,
-                    author=attrs['author']
-            ).exists():
-                raise serializers.ValidationError('You are already subscribed')
-        return attrs
+        if hasattr(obj.author, 'limited_recipes'):
+            recipes = obj.author.limited_recipes
+        else:
+            recipes = obj.author.recipes.all()
+        return FollowRecipeSerializer(recipes, many=True).data
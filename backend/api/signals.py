@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag, User
+from .authentication import revoke_token
+from .caching import bump_version
+from .metrics import install_recorder
+
+
+@receiver(connection_created)
+def connection_opened(connection, **kwargs):
+    install_recorder(connection)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tags_changed(**kwargs):
+    bump_version('tags')
+
+
+# IngredientInRecipe has no receivers, so its rows keep being fast
+# deleted: the recipe serializer saves the recipe along with them and the
+# admin bumps the versions itself.
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipes_changed(**kwargs):
+    # Bumped after the commit, so a page read before the commit is never
+    # cached under the new version.
+    transaction.on_commit(lambda: bump_version('recipes'))
+
+
+# Saving a recipe leaves the match index alone: the recipe serializer
+# bumps the version when it changes which ingredients a recipe uses.
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Ingredient)
+def recipe_ingredients_changed(**kwargs):
+    transaction.on_commit(lambda: bump_version('recipe-ingredients'))
+
+
+@receiver(post_save, sender=User)
+def user_saved(update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        transaction.on_commit(lambda: bump_version('recipes'))
+
+
+# Token revocations are bumped after the commit, so a process resolving
+# the token meanwhile still finds the old row under the old version.
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    # The key is the primary key, which the deletion resets.
+    key = instance.key
+    transaction.on_commit(lambda: revoke_token(key))
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) - {'last_login'}:
+        keys = list(
+            Token.objects.filter(user=instance).values_list('key', flat=True)
+        )
+        transaction.on_commit(
+            lambda: [revoke_token(key) for key in keys]
+        )
@@ -0,0 +1,667 @@
+import tempfile
+from base64 import urlsafe_b64encode
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import (SimpleTestCase, TransactionTestCase,
+                         override_settings)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from foodgram.asgi import application
+from recipes.models import (Favorite, Follow, Ingredient, IngredientInRecipe,
+                            Recipe, Tag, User)
+from recipes.services import (add_favorite, add_to_cart, subscribe,
+                              unsubscribe)
+from .authentication import revoke_token, token_cache
+from .caching import bump_version
+from .checks import check_shared_cache
+from .matching import recipe_match_index
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAA'
+    'A1BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAAeIhvDMAAAAASUV'
+    'ORK5CYII='
+)
+
+
+class QueryCountTests(APITestCase):
+    """The list endpoints run a fixed number of queries per page."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Reader', password='pass12345!'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Tag {number}', slug=f'tag-{number}',
+                               color='#ffffff')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ingredient {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        cls.authors = [
+            User.objects.create_user(
+                email=f'author{number}@example.com',
+                username=f'author{number}', first_name='Author',
+                last_name=str(number), password='pass12345!'
+            )
+            for number in range(6)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def create_recipes(self, count):
+        for number in range(count):
+            author = self.authors[number % len(self.authors)]
+            recipe = Recipe.objects.create(
+                author=author, name=f'Recipe {number}', text='Text',
+                cooking_time=10
+            )
+            recipe.tags.set(self.tags)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=100)
+                for ingredient in self.ingredients
+            )
+        Follow.objects.bulk_create(
+            (Follow(user=self.user, author=author)
+             for author in self.authors[:Recipe.objects.count()]),
+            ignore_conflicts=True
+        )
+
+    def assert_constant_queries(self, url, count):
+        """Assert the query count of ``url`` with one and with six
+        recipes, authors and subscriptions."""
+        for recipes in (1, 5):
+            self.create_recipes(recipes)
+            with self.subTest(recipes=Recipe.objects.count()):
+                cache.clear()
+                with self.assertNumQueries(count):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_recipe_list(self):
+        # Count, the shared page, its tags and ingredients, then the
+        # user's flags for the page. Postgres first reads the planner
+        # estimate of the unfiltered table.
+        estimate = connection.vendor == 'postgresql'
+        self.assert_constant_queries('/api/recipes/', 5 + estimate)
+
+    def test_recipe_list_with_tag_filter(self):
+        self.assert_constant_queries(
+            f'/api/recipes/?tags={self.tags[0].slug}', 6
+        )
+
+    def test_recipe_detail(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']),
+                         len(self.ingredients))
+        self.assertEqual(len(response.data['tags']), len(self.tags))
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+    def test_subscriptions(self):
+        # Count, then the page of authors and their latest recipes.
+        self.assert_constant_queries(
+            '/api/users/subscriptions/?recipes_limit=2', 3
+        )
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.other = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name=name, password='pass12345!'
+            )
+            for name in ('reader', 'author', 'other')
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+        subscribe(self.reader, self.author)
+
+    def publish(self, name):
+        return Recipe.objects.create(
+            author=self.author, name=name, text='Text', cooking_time=10
+        )
+
+    def read_feed(self, url):
+        names = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names.append([recipe['name'] for recipe in response.data['results']])
+            url = response.data['next']
+        return names
+
+    def test_filtered_pages_are_full(self):
+        recipes = [self.publish(f'Recipe {number}') for number in range(7)]
+        for recipe in (recipes[0], recipes[1], recipes[5]):
+            add_favorite(self.reader, recipe)
+        self.assertEqual(
+            self.read_feed('/api/recipes/feed/?limit=2&is_favorited=1'),
+            [['Recipe 5', 'Recipe 1'], ['Recipe 0']]
+        )
+
+    def test_filters_apply_to_the_feed(self):
+        lunch = Tag.objects.create(name='Lunch', slug='lunch',
+                                   color='#ffffff')
+        recipes = [self.publish(f'Recipe {number}') for number in range(4)]
+        for recipe in (recipes[0], recipes[2]):
+            recipe.tags.add(lunch)
+        self.assertEqual(self.read_feed('/api/recipes/feed/?tags=lunch'),
+                         [['Recipe 2', 'Recipe 0']])
+        self.assertEqual(
+            self.read_feed(f'/api/recipes/feed/?author={self.other.id}'),
+            [[]]
+        )
+
+    def test_recipes_published_over_fanout_limit_stay_in_feed(self):
+        self.publish('Before')
+        subscribe(self.other, self.author)
+        self.publish('While popular')
+        unsubscribe(self.other, self.author.id)
+        self.publish('After')
+        self.assertEqual(self.read_feed('/api/recipes/feed/'),
+                         [['After', 'While popular', 'Before']])
+
+
+class KeysetPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author', password='pass12345!'
+        )
+        cls.recipes = [
+            Recipe.objects.create(author=author, name=f'Recipe {number}',
+                                  text='Text', cooking_time=10)
+            for number in range(5)
+        ]
+        # Recipes 1 to 3 share their pub_date, the id breaks the tie.
+        Recipe.objects.filter(pk__in=[
+            recipe.pk for recipe in cls.recipes[1:4]
+        ]).update(pub_date=cls.recipes[2].pub_date)
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        return page, [recipe['name'] for recipe in page['results']]
+
+    def test_links_round_trip(self):
+        first_url = '/api/recipes/?pagination=cursor&limit=2'
+        pages = []
+        url = first_url
+        while url:
+            page, names = self.get_page(url)
+            pages.append(names)
+            url = page['next']
+        self.assertEqual(pages, [['Recipe 4', 'Recipe 3'],
+                                 ['Recipe 2', 'Recipe 1'], ['Recipe 0']])
+        first_page, _ = self.get_page(first_url)
+        self.assertIsNone(first_page['previous'])
+        back = []
+        url = page['previous']
+        while url:
+            page, names = self.get_page(url)
+            back.append(names)
+            url = page['previous']
+        self.assertEqual(back, pages[-2::-1])
+        _, names = self.get_page(page['next'])
+        self.assertEqual(names, pages[1])
+
+    def test_malformed_cursors_are_rejected(self):
+        def encode(position):
+            return urlsafe_b64encode(position.encode()).decode()
+
+        for cursor in (
+            'garbage',
+            encode('not json'),
+            encode('[1, 2]'),
+            encode('{"d": "2021-01-01T00:00:00+00:00", "r": 0}'),
+            encode('{"d": "yesterday", "i": 1, "r": 0}'),
+            encode('{"d": "2021-01-01T00:00:00+00:00", "i": 1e30, "r": 0}'),
+        ):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/recipes/',
+                                           {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(),
+                                 {'cursor': ['Invalid cursor']})
+
+
+class BatchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name=name, password='pass12345!'
+            )
+            for name in ('user', 'author')
+        ]
+        cls.soup, cls.pie = [
+            Recipe.objects.create(author=cls.author, name=name, text='Text',
+                                  cooking_time=10)
+            for name in ('Soup', 'Pie')
+        ]
+        cls.missing = cls.pie.id + 100
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, url, ids, status_code=200):
+        response = getattr(self.client, method)(url, {'ids': ids},
+                                                format='json')
+        self.assertEqual(response.status_code, status_code)
+        return response.data
+
+    def statuses(self, method, url, ids):
+        return [
+            (result['id'], result['status'])
+            for result in self.batch(method, url, ids)['results']
+        ]
+
+    def test_mixed_existing_and_missing_ids(self):
+        url = '/api/recipes/favorite/batch/'
+        add_favorite(self.user, self.soup)
+        self.assertEqual(
+            self.statuses('post', url, [self.soup.id, self.pie.id,
+                                        self.missing]),
+            [(self.soup.id, 'exists'), (self.pie.id, 'added'),
+             (self.missing, 'not_found')]
+        )
+        self.pie.refresh_from_db()
+        self.assertEqual(self.pie.favorites_count, 1)
+        self.assertEqual(
+            self.statuses('delete', url, [self.pie.id, self.missing]),
+            [(self.pie.id, 'removed'), (self.missing, 'not_found')]
+        )
+        self.pie.refresh_from_db()
+        self.assertEqual(self.pie.favorites_count, 0)
+
+    def test_subscribing_to_yourself_is_invalid(self):
+        self.assertEqual(
+            self.statuses('post', '/api/users/subscribe/batch/',
+                          [self.user.id, self.author.id]),
+            [(self.user.id, 'invalid'), (self.author.id, 'added')]
+        )
+
+    def test_duplicate_ids_are_handled_once(self):
+        url = '/api/recipes/shopping_cart/batch/'
+        self.assertEqual(
+            self.statuses('post', url, [self.pie.id, self.soup.id,
+                                        self.pie.id]),
+            [(self.pie.id, 'added'), (self.soup.id, 'added')]
+        )
+        self.pie.refresh_from_db()
+        self.assertEqual(self.pie.in_carts_count, 1)
+
+    def test_at_most_100_ids(self):
+        url = '/api/recipes/favorite/batch/'
+        ids = list(range(self.missing, self.missing + 100))
+        self.assertEqual(len(self.batch('post', url, ids)['results']), 100)
+        errors = self.batch('post', url, ids + [self.pie.id], 400)
+        self.assertIn('ids', errors)
+        self.assertIn('ids', self.batch('post', url, [], 400))
+        self.assertFalse(Favorite.objects.filter(user=self.user).exists())
+
+
+class TokenCacheTests(APITestCase):
+    """Cached tokens are checked against revocations in the shared cache,
+    which other processes bump as well."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.entries.clear()
+        self.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Reader', password='pass12345!'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        for _ in range(2):
+            self.assertEqual(self.get_me().status_code, 200)
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    # The profile itself reads whether the user follows themselves.
+    def test_warm_token_skips_the_lookup(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_me().status_code, 200)
+
+    def test_revoked_token_is_rejected(self):
+        revoke_token(self.token.key)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_me().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_user_changes_revoke_tokens(self):
+        self.user.first_name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.get_me().data['first_name'], 'Renamed')
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.get_me().status_code, 401)
+
+
+class ASGITests(TransactionTestCase):
+    """Requests served by ``foodgram.asgi``, whose worker threads only see
+    committed rows."""
+
+    def setUp(self):
+        user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Reader', password='pass12345!'
+        )
+        self.token = Token.objects.create(user=user)
+        recipe = Recipe.objects.create(
+            author=user, name='Recipe', text='Text', cooking_time=10
+        )
+        IngredientInRecipe.objects.create(
+            recipe=recipe, amount=300, ingredient=Ingredient.objects.create(
+                name='Flour', measurement_unit='г'
+            )
+        )
+        add_to_cart(user, recipe)
+
+    def get(self, path, query_string=b''):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(application)({
+            'type': 'http', 'method': 'GET', 'path': path,
+            'query_string': query_string, 'server': ('testserver', 80),
+            'headers': [
+                (b'authorization', f'Token {self.token.key}'.encode()),
+            ],
+        }, receive, send)
+        start, *body = messages
+        return start['status'], b''.join(
+            message.get('body', b'') for message in body
+        )
+
+    def test_download_shopping_cart(self):
+        for path in ('/api/recipes/download_shopping_cart/',
+                     '/api/async/recipes/download_shopping_cart/'):
+            with self.subTest(path=path):
+                status, body = self.get(path, b'format=csv')
+                self.assertEqual(status, 200)
+                self.assertEqual(
+                    body.decode().splitlines(),
+                    ['name,amount,measurement_unit', 'Flour,300,г']
+                )
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(APITestCase):
+    """Routing against a second SQLite database standing in for a replica
+    that has not caught up with the primary: it only has a tag of its own.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:',
+            'CONN_MAX_AGE': None,
+        }
+        with connections['replica'].schema_editor() as editor:
+            editor.create_model(Tag)
+        Tag.objects.using('replica').create(name='Replica', slug='replica',
+                                            color='#000000')
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Primary', slug='primary', color='#ffffff')
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Reader', password='pass12345!'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Recipe', text='Text', cooking_time=10
+        )
+
+    def setUp(self):
+        cache.clear()
+        token_cache.entries.clear()
+
+    def tag_names(self, token=None):
+        # Skip the cached list without clearing the pins.
+        bump_version('tags')
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        response = self.client.get('/api/tags/', **headers)
+        self.assertEqual(response.status_code, 200)
+        return [tag['name'] for tag in response.json()]
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.tag_names(), ['Replica'])
+        # The token is only on the primary, where it is looked up.
+        token = Token.objects.create(user=self.user).key
+        self.assertEqual(self.tag_names(token), ['Replica'])
+
+    def test_writes_pin_the_client_to_primary(self):
+        token = Token.objects.create(user=self.user).key
+        response = self.client.post(
+            '/api/recipes/favorite/batch/', {'ids': [self.recipe.id]},
+            format='json', HTTP_AUTHORIZATION=f'Token {token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.tag_names(token), ['Primary'])
+        self.assertEqual(self.tag_names(), ['Replica'])
+
+    def test_client_without_credentials(self):
+        response = self.client.post('/api/users/', {
+            'email': 'new@example.com', 'username': 'new',
+            'first_name': 'New', 'last_name': 'User',
+            'password': 'pass12345!',
+        })
+        self.assertEqual(response.status_code, 201)
+        # Nothing identifies the client yet, so nothing is pinned.
+        self.assertEqual(self.tag_names(), ['Replica'])
+        response = self.client.post('/api/auth/token/login/', {
+            'email': 'new@example.com', 'password': 'pass12345!',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.tag_names(response.data['auth_token']),
+                         ['Replica'])
+
+
+class MatchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='cook@example.com', username='cook',
+            first_name='Cook', last_name='Cook', password='pass12345!'
+        )
+        cls.flour, cls.eggs, cls.milk, cls.sugar, cls.butter = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Flour', 'Eggs', 'Milk', 'Sugar', 'Butter')
+        ]
+        for name, ingredients in (
+            ('Noodles', [cls.flour, cls.eggs]),
+            ('Pancakes', [cls.flour, cls.eggs, cls.milk]),
+            ('Cake', [cls.flour, cls.eggs, cls.sugar, cls.butter]),
+            ('Cocoa', [cls.milk]),
+        ):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=name, text='Text', cooking_time=10
+            )
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=100)
+                for ingredient in ingredients
+            )
+
+    def setUp(self):
+        # Built again in this thread, which sees the test's rows.
+        recipe_match_index.data = recipe_match_index.version = None
+        self.client.force_authenticate(self.user)
+
+    def match(self, ingredients, **params):
+        response = self.client.get('/api/recipes/match/', {
+            'ingredients': [ingredient.id for ingredient in ingredients],
+            **params
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def names(self, ingredients, **params):
+        return [
+            (recipe['name'], recipe['matched'], recipe['coverage'])
+            for recipe in self.match(ingredients, **params)['results']
+        ]
+
+    def test_ranking(self):
+        self.assertEqual(self.names([self.flour, self.eggs, self.sugar]), [
+            ('Noodles', 2, 1.0),
+            ('Cake', 3, 0.75),
+            ('Pancakes', 2, 0.6667),
+        ])
+
+    def test_require_all_keeps_recipes_cooked_from_the_ingredients(self):
+        pantry = [self.flour, self.eggs, self.milk, self.sugar]
+        self.assertEqual(self.names(pantry, require_all='true'), [
+            ('Pancakes', 3, 1.0),
+            ('Noodles', 2, 1.0),
+            ('Cocoa', 1, 1.0),
+        ])
+        self.assertEqual(
+            self.names([self.flour], require_all='true'), []
+        )
+
+    def test_pagination(self):
+        pantry = [self.flour, self.eggs, self.milk, self.sugar]
+        first = self.match(pantry, limit=2)
+        self.assertEqual(first['count'], 4)
+        second = self.client.get(first['next']).data
+        self.assertIsNone(second['next'])
+        self.assertEqual(
+            [recipe['name'] for recipe in first['results']
+             + second['results']],
+            ['Pancakes', 'Noodles', 'Cocoa', 'Cake']
+        )
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    local = {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }}
+    shared = {'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': 'cache:11211',
+    }}
+
+    def test_process_local_cache_is_an_error(self):
+        with override_settings(CACHES=self.local, DEBUG=False):
+            self.assertEqual(
+                [error.id for error in check_shared_cache(None)],
+                ['api.E001']
+            )
+        with override_settings(CACHES=self.local, DEBUG=True):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES=self.shared, DEBUG=False):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), RECIPE_IMAGE_WORKERS=0)
+class RecipeCounterTests(APITestCase):
+
+    def test_recipes_count_follows_recipes(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author', password='pass12345!'
+        )
+        tag = Tag.objects.create(name='Lunch', slug='lunch', color='#ffffff')
+        ingredient = Ingredient.objects.create(name='Flour',
+                                               measurement_unit='г')
+        self.client.force_authenticate(author)
+        response = self.client.post('/api/recipes/', {
+            'name': 'Recipe', 'text': 'Text', 'cooking_time': 10,
+            'image': IMAGE, 'tags': [tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 100}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 1)
+        response = self.client.delete(
+            f'/api/recipes/{response.data["id"]}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        author.refresh_from_db()
+        self.assertEqual(author.recipes_count, 0)
+
+
+class RecipeValidationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author', password='pass12345!'
+        )
+        cls.tag = Tag.objects.create(name='Lunch', slug='lunch',
+                                     color='#ffffff')
+        cls.ingredient = Ingredient.objects.create(name='Flour',
+                                                   measurement_unit='г')
+
+    def test_malformed_ingredients_and_tags_are_rejected(self):
+        self.client.force_authenticate(self.author)
+        ingredient = {'id': self.ingredient.id, 'amount': 100}
+        for field, value in (
+            ('ingredients', [{'id': self.ingredient.id, 'amount': 'a lot'}]),
+            ('ingredients', [{'id': self.ingredient.id}]),
+            ('ingredients', [{'id': None, 'amount': 100}]),
+            ('ingredients', [{'id': 2 ** 63, 'amount': 100}]),
+            ('ingredients', [{'id': self.ingredient.id, 'amount': 0}]),
+            ('ingredients', ['flour']),
+            ('ingredients', 5),
+            ('tags', ['lunch']),
+            ('tags', [None]),
+            ('tags', 5),
+        ):
+            with self.subTest(field=field, value=value):
+                response = self.client.post('/api/recipes/', {
+                    'name': 'Recipe', 'text': 'Text', 'cooking_time': 10,
+                    'image': IMAGE, 'tags': [self.tag.id],
+                    'ingredients': [ingredient], field: value,
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+        self.assertFalse(Recipe.objects.exists())
@@ -1,9 +1,11 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .serializers import CreateRecipeSerializer
 from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
-                    CustomUserViewSet, PurchaseListView, FavoriteViewSet)
+                    CustomUserViewSet, PurchaseListView, FavoriteViewSet,
+                    MetricsView)
 
 app_name = 'api'
 
@@ -14,8 +16,26 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('users', CustomUserViewSet, basename='users')
 
+# Thread-offloaded copies of the hot read endpoints for ASGI servers.
+async_urlpatterns = [
+    path('recipes/', async_views.recipe_list, name='recipes-list-async'),
+    path('recipes/download_shopping_cart/',
+         async_views.download_shopping_cart,
+         name='recipes-download-shopping-cart-async'),
+    path('recipes/<int:pk>/', async_views.recipe_detail,
+         name='recipes-detail-async'),
+    path('tags/', async_views.tag_list, name='tags-list-async'),
+    path('tags/<int:pk>/', async_views.tag_detail, name='tags-detail-async'),
+    path('ingredients/', async_views.ingredient_list,
+         name='ingredients-list-async'),
+    path('ingredients/<int:pk>/', async_views.ingredient_detail,
+         name='ingredients-detail-async'),
+]
+
 urlpatterns = [
     path('', include(router.urls)),
+    path('async/', include(async_urlpatterns)),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('recipes/<int:recipe_id>/shopping_cart/',
          PurchaseListView.as_view(), name='add_recipe_to_shopping_cart'),
     path('recipes/<int:recipe_id>/favorite/',
@@ -1,23 +1,42 @@
-from django.db.models import Exists, OuterRef
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Subquery, Value
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from recipes.models import (Favorite, Ingredient, PurchaseList, Recipe,
-                            Follow, Tag, IngredientInRecipe, User)
-from .filters import IngredientNameFilter, RecipeFilter
-from .paginators import PageNumberPaginatorModified
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
+                            PurchaseList, Recipe, Follow, Tag, User)
+from recipes.services import (add_favorite, add_many, add_to_cart,
+                              backfill_feed, get_shopping_list,
+                              remove_favorite, remove_from_cart,
+                              remove_from_feed, remove_many, subscribe,
+                              unsubscribe, update_counter, user_recipe_flags)
+from .autocomplete import ingredient_index
+from .filters import RecipeFilter
+from .matching import recipe_match_index
+from .metrics import route_metrics
+from .mixins import RecipeListCacheMixin, VersionedCacheMixin
+from .paginators import (FeedPagination, KeysetPagination,
+                         PageNumberPaginatorModified)
 from .permissions import IsOwnerOrAdminOrReadOnly
-from .serializers import (CreateRecipeSerializer, FavoriteSerializer,
-                          IngredientSerializer, PurchaseListSerializer,
-                          FollowSerializer, FollowerSerializer, TagSerializer,
-                          UserSerializer)
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
+from .serializers import (BatchSerializer, CreateRecipeSerializer,
+                          FollowerSerializer, FollowRecipeSerializer,
+                          IngredientSerializer, RecipeMatchQuerySerializer,
+                          RecipeMatchSerializer, RecipeShortSerializer,
+                          TagSerializer, UserSerializer)
 
 
 class CustomUserViewSet(UserViewSet):
@@ -29,34 +48,57 @@ class CustomUserViewSet(UserViewSet):
     @action(detail=True, permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
         user = request.user
-        author = get_object_or_404(User, id=id)
+        author = get_object_or_404(User.objects.only('id'), id=id)
+        if user.id == author.id:
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'You can not subscribe to yourself'
+                ]
+            })
+        if not subscribe(user, author):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'You are already subscribed'
+                ]
+            })
         data = {
             'user': user.id,
             'author': author.id,
         }
-        serializer = FollowSerializer(
-            data=data, context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id=None):
-        user = request.user
-        author = get_object_or_404(User, id=id)
-        subscribe = get_object_or_404(
-            Follow, user=user, author=author
-        )
-        subscribe.delete()
+        if not unsubscribe(request.user, id):
+            raise NotFound()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='subscribe/batch', permission_classes=[IsAuthenticated])
+    def subscribe_batch(self, request):
+        return batch_response(request, Follow, 'author', 'followers_count')
+
     @action(detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         user = request.user
-        queryset = Follow.objects.filter(user=user)
+        recipes_limit = request.query_params.get('recipes_limit')
+        recipes = Recipe.objects.only('id', 'name', 'image',
+                                      'image_renditions', 'cooking_time',
+                                      'author_id')
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author_id=OuterRef('author_id')
+                ).values('pk')[:int(recipes_limit)]
+            ))
+        queryset = Follow.objects.filter(user=user).select_related(
+            'author'
+        ).prefetch_related(
+            Prefetch('author__recipes', queryset=recipes,
+                     to_attr='limited_recipes')
+        ).order_by('-id')
         pages = self.paginate_queryset(queryset)
         serializer = FollowerSerializer(
             pages,
@@ -66,31 +108,66 @@ class CustomUserViewSet(UserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(RecipeListCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = CreateRecipeSerializer
     permission_classes = (IsOwnerOrAdminOrReadOnly,)
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
     filter_class = RecipeFilter
+    ordering_fields = ['pub_date', 'favorites_count', 'in_carts_count']
     pagination_class = PageNumberPaginatorModified
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if self.action == 'feed':
+                self._paginator = FeedPagination()
+            elif self.action == 'list' and (
+                params.get('pagination') == 'cursor' or 'cursor' in params
+            ):
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        return serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        update_counter(User, recipe.author_id, 'recipes_count', 1)
+        serializer.instance = self.get_queryset().get(pk=recipe.pk)
+
+    def perform_update(self, serializer):
+        recipe = serializer.save()
+        serializer.instance = self.get_queryset().get(pk=recipe.pk)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        update_counter(User, instance.author_id, 'recipes_count', -1)
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Recipe.objects.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients_amounts',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
 
         if user.is_anonymous:
-            return Recipe.objects.all()
-
-        queryset = Recipe.objects.annotate(
-            is_favorited=Exists(Favorite.objects.filter(
-                user=user, recipe_id=OuterRef('pk')
-            )),
-            is_in_shopping_cart=Exists(PurchaseList.objects.filter(
-                user=user, recipe_id=OuterRef('pk')
-            ))
-        )
+            return queryset
+        if self.shared_list:
+            return queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False)
+            )
+
+        queryset = queryset.annotate(**user_recipe_flags(user))
 
         if self.request.GET.get('is_favorited'):
             return queryset.filter(is_favorited=True)
@@ -99,105 +176,191 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return queryset
 
-    @action(detail=True, permission_classes=[IsAuthenticated])
-    def shopping_cart(self, request, pk=None):
-        user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
-        data = {
-            'user': user.id,
-            'recipe': recipe.id,
-        }
-        serializer = PurchaseListSerializer(
-            data=data,
-            context={'request': request}
+    @action(detail=False)
+    def match(self, request):
+        query = RecipeMatchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        page = self.paginate_queryset(recipe_match_index.match(
+            query.validated_data['ingredients'],
+            query.validated_data['require_all']
+        ))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        matches = []
+        for recipe_id, matched, coverage in page:
+            # The index may still list a recipe deleted since it was built.
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.matched = matched
+                recipe.coverage = round(coverage, 4)
+                matches.append(recipe)
+        serializer = RecipeMatchSerializer(
+            matches, many=True, context=self.get_serializer_context()
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+        return self.get_paginated_response(serializer.data)
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    @action(detail=True, permission_classes=[IsAuthenticated])
+    def shopping_cart(self, request, pk=None):
+        return add_to_cart_response(request, pk)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk=None):
-        user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
-        favorites = get_object_or_404(
-            PurchaseList, user=user, recipe=recipe
-        )
-        favorites.delete()
+        if not remove_from_cart(request.user, pk):
+            raise NotFound()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, permission_classes=[IsAuthenticated])
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart/batch',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return batch_response(
+            request, PurchaseList, 'recipe', 'in_carts_count'
+        )
+
+    @action(detail=False, url_path='shopping_cart/summary',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_summary(self, request):
+        return Response({
+            'ingredients': list(get_shopping_list(request.user)),
+        })
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='favorite/batch', permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return batch_response(request, Favorite, 'recipe', 'favorites_count')
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                          ShoppingListPDFRenderer]
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        shopping_cart = user.purchases.all()
-        list = {}
-        for item in shopping_cart:
-            recipe = item.recipe
-            ingredients = IngredientInRecipe.objects.filter(recipe=recipe)
-            for ingredient in ingredients:
-                amount = ingredient.amount
-                name = ingredient.ingredient.name
-                measurement_unit = ingredient.ingredient.measurement_unit
-                if name not in list:
-                    list[name] = {
-                        'measurement_unit': measurement_unit,
-                        'amount': amount
-                    }
-                else:
-                    list[name]['amount'] = (
-                        list[name]['amount'] + amount
-                    )
-
-        shopping_list = []
-        for item in list:
-            shopping_list.append(f'{item} - {list[item]["amount"]} '
-                                 f'{list[item]["measurement_unit"]} \n')
-        response = HttpResponse(shopping_list, 'Content-Type: text/plain')
-        response['Content-Disposition'] = 'attachment; filename="shoplist.txt"'
+        renderer = request.accepted_renderer
+        shopping_list = get_shopping_list(request.user)
+        response = StreamingHttpResponse(
+            renderer.stream(shopping_list),
+            content_type=renderer.media_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shoplist.{renderer.format}"'
+        )
 
         return response
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_version_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
+    cache_version_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
-    filter_backends = [IngredientNameFilter]
-    search_fields = ['^name']
+    filter_backends = []
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        if request.query_params.get('limit', '').isdigit():
+            limit = min(int(request.query_params['limit']), limit)
+        serializer = self.get_serializer(
+            ingredient_index.search(name, limit), many=True
+        )
+        return Response(serializer.data)
+
+
+def batch_response(request, model, field, counter_field):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    statuses = {}
+    targets = ids
+    if model is Follow and request.user.id in ids:
+        statuses[request.user.id] = 'invalid'
+        targets = [pk for pk in ids if pk != request.user.id]
+    with transaction.atomic():
+        if request.method == 'DELETE':
+            statuses.update(remove_many(
+                model, request.user, field, targets, counter_field
+            ))
+        else:
+            statuses.update(add_many(
+                model, request.user, field, targets, counter_field
+            ))
+        if model is Follow:
+            update_feed(request.user, statuses)
+    return Response({'results': [
+        {'id': pk, 'status': statuses[pk]} for pk in ids
+    ]})
+
+
+def update_feed(user, statuses):
+    added = [pk for pk, result in statuses.items() if result == 'added']
+    removed = [pk for pk, result in statuses.items() if result == 'removed']
+    if added:
+        backfill_feed(user, added)
+    if removed:
+        remove_from_feed(user, removed)
+
+
+def get_short_recipe(recipe_id):
+    return get_object_or_404(
+        Recipe.objects.only(
+            'id', 'name', 'image', 'image_renditions', 'cooking_time'
+        ),
+        id=recipe_id
+    )
+
+
+def add_to_cart_response(request, recipe_id):
+    recipe = get_short_recipe(recipe_id)
+    if not add_to_cart(request.user, recipe):
+        raise ValidationError({
+            api_settings.NON_FIELD_ERRORS_KEY: [
+                'Recipe is already added to purchase list'
+            ]
+        })
+    serializer = RecipeShortSerializer(recipe, context={'request': request})
+    return Response(serializer.data, status.HTTP_201_CREATED)
 
 
 class FavoriteViewSet(APIView):
     def get(self, request, recipe_id):
-        user = request.user.id
-        data = {
-            'user': user,
-            'recipe': recipe_id
-        }
-        serializer = FavoriteSerializer(
-            data=data, context={'request': request}
+        recipe = get_short_recipe(recipe_id)
+        if not add_favorite(request.user, recipe):
+            raise ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Recipe is already in favorites'
+                ]
+            })
+        serializer = FollowRecipeSerializer(
+            recipe, context={'request': request}
         )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
         return Response(serializer.data, status.HTTP_201_CREATED)
 
     def delete(self, request, recipe_id):
-        user = request.user
-        favorite_recipe = get_object_or_404(
-            Favorite,
-            user=user,
-            recipe__id=recipe_id
-        )
-        favorite_recipe.delete()
+        if not remove_favorite(request.user, recipe_id):
+            raise NotFound()
         return Response(
             'Recipe is deleted from favorites.',
             status.HTTP_204_NO_CONTENT
@@ -206,28 +369,22 @@ class FavoriteViewSet(APIView):
 
 class PurchaseListView(APIView):
     def get(self, request, recipe_id):
-        user = request.user.id
-        data = {
-            'user': user,
-            'recipe': recipe_id
-        }
-        serializer = PurchaseListSerializer(
-            data=data,
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status.HTTP_201_CREATED)
+        return add_to_cart_response(request, recipe_id)
 
     def delete(self, request, recipe_id):
-        user = request.user
-        purchace_list_recipe = get_object_or_404(
-            PurchaseList,
-            user=user,
-            recipe__id=recipe_id
-        )
-        purchace_list_recipe.delete()
+        if not remove_from_cart(request.user, recipe_id):
+            raise NotFound()
         return Response(
             'Recipe is deleted from purchase list',
             status.HTTP_204_NO_CONTENT
         )
+
+
+class MetricsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            route_metrics.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -1,7 +1,55 @@
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+from .streaming import OffloadedStreamingResponse
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
-application = get_asgi_application()
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGI handler reading streaming bodies off the event loop.
+
+    Django 3.2 iterates every streaming body synchronously inside the event
+    loop, where a body running queries, such as the shopping list, fails.
+    Streaming responses are read with ``async for`` instead; those of sync
+    views are wrapped in ``OffloadedStreamingResponse`` first, so their
+    chunks are produced in a worker thread while the loop serves other
+    requests.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+        if not hasattr(response, '__aiter__'):
+            response = OffloadedStreamingResponse(response)
+        headers = [
+            (str(header).encode('ascii'), str(value).encode('latin1'))
+            for header, value in response.items()
+        ]
+        for cookie in response.cookies.values():
+            headers.append((
+                b'Set-Cookie',
+                cookie.output(header='').encode('ascii').strip()
+            ))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+        async for part in response:
+            for chunk, _ in self.chunk_bytes(part):
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
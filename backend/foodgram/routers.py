@@ -0,0 +1,134 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Credentials are always read from the primary, so a token or session is
+# usable as soon as it is issued, before the replicas catch up.
+PRIMARY_MODELS = {'authtoken.token', 'sessions.session'}
+PRIMARY_PATHS = ('/api/auth/',)
+
+routing_state = ContextVar('routing_state', default=None)
+
+
+class RoutingState:
+    """Database routing decisions of the request being served."""
+
+    def __init__(self, replica=None):
+        self.replica = replica
+        self.wrote = False
+
+
+def reading_from_replica():
+    state = routing_state.get()
+    return state is not None and state.replica is not None and not state.wrote
+
+
+class ReplicaRouter:
+    """Send reads of safe API requests to a replica, everything else to
+    the primary.
+
+    The replica is picked once per request by ``ReplicaRoutingMiddleware``.
+    Reads outside of a request, reads after the request has written
+    anything and reads of credentials go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if (state is None or state.wrote or state.replica is None
+                or model._meta.label_lower in PRIMARY_MODELS):
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def pin_key(request):
+    """Cache key identifying the client, from its token or session."""
+    credentials = request.META.get('HTTP_AUTHORIZATION') or (
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    digest = hashlib.sha256(credentials.encode()).hexdigest()
+    return f'db-pin:{digest}'
+
+
+def cache_call(method, *args):
+    return sync_to_async(method, thread_sensitive=False)(*args)
+
+
+class ReplicaRoutingMiddleware:
+    """Choose the database of every API request.
+
+    Safe requests are served from a random replica of ``DATABASE_REPLICAS``
+    unless the same client wrote something during the last
+    ``REPLICA_PIN_SECONDS``, so clients always read their own writes.
+    Authentication routes are always served from the primary.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def may_use_replica(self, request):
+        return (settings.DATABASE_REPLICAS
+                and request.method in SAFE_METHODS
+                and request.path.startswith('/api/')
+                and not request.path.startswith(PRIMARY_PATHS))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        key = pin_key(request)
+        replica = None
+        if self.may_use_replica(request) and not (key and cache.get(key)):
+            replica = random.choice(settings.DATABASE_REPLICAS)
+        state = RoutingState(replica)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote and key and settings.DATABASE_REPLICAS:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        # The cache is asked from a worker thread of its own rather than
+        # the single thread Django runs all sync code of ASGI requests in.
+        key = pin_key(request)
+        replica = None
+        if self.may_use_replica(request) and not (
+            key and await cache_call(cache.get, key)
+        ):
+            replica = random.choice(settings.DATABASE_REPLICAS)
+        state = RoutingState(replica)
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        if state.wrote and key and settings.DATABASE_REPLICAS:
+            await cache_call(cache.set, key, True, settings.REPLICA_PIN_SECONDS)
+        return response
@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.http import StreamingHttpResponse
+
+DONE = object()
+
+
+class OffloadedStreamingResponse(StreamingHttpResponse):
+    """Streaming response whose chunks are produced in a single worker
+    thread of its own.
+
+    Under ASGI Django iterates streaming bodies inside the event loop,
+    where the ORM refuses to run. Here every chunk is read in the worker
+    thread instead, which keeps the connection and server-side cursor of
+    a generator running queries. ``foodgram.asgi`` reads the body with
+    ``async for``, so the loop waits for a chunk without blocking; plain
+    iteration, as on WSGI servers, waits for the thread.
+
+    The thread and its database connection go away once the body is read
+    or the response is closed, whichever comes first.
+    """
+
+    def __init__(self, response, executor=None):
+        super().__init__(
+            response.streaming_content, status=response.status_code
+        )
+        copy_headers(response, self)
+        self._resource_closers.extend(response._resource_closers)
+        response._resource_closers.clear()
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def finish(closers):
+        for closer in closers:
+            closer()
+        connections.close_all()
+
+    def release(self):
+        """Let the worker thread run the closers, close its connections
+        and exit. Never waits for it, so it is safe to call from the
+        worker thread itself, as test clients closing the response do."""
+        if self.executor is None:
+            return
+        executor, self.executor = self.executor, None
+        closers = list(self._resource_closers)
+        self._resource_closers.clear()
+        executor.submit(self.finish, closers)
+        executor.shutdown(wait=False)
+
+    async def __aiter__(self):
+        run = sync_to_async(
+            next, thread_sensitive=False, executor=self.executor
+        )
+        try:
+            while (chunk := await run(self._iterator, DONE)) is not DONE:
+                yield self.make_bytes(chunk)
+        finally:
+            self.release()
+
+    def __iter__(self):
+        executor = self.executor
+        try:
+            while (chunk := executor.submit(
+                next, self._iterator, DONE
+            ).result()) is not DONE:
+                yield self.make_bytes(chunk)
+        finally:
+            self.release()
+
+    def close(self):
+        self.release()
+        super().close()
+
+
+def copy_headers(source, target):
+    for header, value in source.items():
+        target[header] = value
+    for cookie in source.cookies.values():
+        target.cookies[cookie.key] = cookie
@@ -1,7 +1,51 @@
+from contextlib import contextmanager
+
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import Q
 
+from api.caching import bump_version
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe,
                             PurchaseList, Recipe, Follow, Tag)
+from recipes.services import (ingredient_changes, lock_recipes,
+                              rebuild_cart_totals, recipe_ingredient_amounts,
+                              schedule_search_update, update_carts_of_recipe)
+
+
+def recipe_ingredients_changed():
+    bump_version('recipes')
+    bump_version('recipe-ingredients')
+
+
+class IngredientAmountsAdminMixin:
+    """Keeps what depends on the ingredients of a recipe up to date when
+    ingredient amounts are edited in the admin, bypassing the recipe
+    serializer."""
+
+    @contextmanager
+    def tracking_changes(self, ingredient_amounts):
+        with transaction.atomic():
+            before = recipe_ingredient_amounts(ingredient_amounts)
+            yield
+            changes = ingredient_changes(
+                before, recipe_ingredient_amounts(ingredient_amounts)
+            )
+            if not changes:
+                return
+            lock_recipes(changes)
+            for recipe_id, recipe_changes in changes.items():
+                update_carts_of_recipe(recipe_id, recipe_changes)
+            schedule_search_update(*changes)
+            transaction.on_commit(recipe_ingredients_changed)
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not IngredientInRecipe:
+            super().save_formset(request, form, formset, change)
+            return
+        with self.tracking_changes(IngredientInRecipe.objects.filter(
+            **{formset.fk.name: form.instance}
+        )):
+            super().save_formset(request, form, formset, change)
 
 
 class IngredientRecipeInLine(admin.TabularInline):
@@ -9,17 +53,60 @@ class IngredientRecipeInLine(admin.TabularInline):
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin):
+class IngredientAdmin(IngredientAmountsAdminMixin, admin.ModelAdmin):
     inlines = [IngredientRecipeInLine]
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(IngredientAmountsAdminMixin, admin.ModelAdmin):
     inlines = [IngredientRecipeInLine]
 
 
+@admin.register(IngredientInRecipe)
+class IngredientInRecipeAdmin(IngredientAmountsAdminMixin,
+                              admin.ModelAdmin):
+
+    def save_model(self, request, obj, form, change):
+        with self.tracking_changes(IngredientInRecipe.objects.filter(
+            Q(pk=obj.pk)
+            | Q(recipe_id=obj.recipe_id, ingredient_id=obj.ingredient_id)
+        )):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with self.tracking_changes(
+            IngredientInRecipe.objects.filter(pk=obj.pk)
+        ):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with self.tracking_changes(IngredientInRecipe.objects.filter(
+            pk__in=list(queryset.values_list('pk', flat=True))
+        )):
+            super().delete_queryset(request, queryset)
+
+
+@admin.register(PurchaseList)
+class PurchaseListAdmin(admin.ModelAdmin):
+    """Rebuilds the cart totals of the users whose carts are edited here."""
+
+    def save_model(self, request, obj, form, change):
+        user_ids = {obj.user_id, *PurchaseList.objects.filter(
+            pk=obj.pk
+        ).values_list('user_id', flat=True)}
+        super().save_model(request, obj, form, change)
+        rebuild_cart_totals(user_ids)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_cart_totals([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rebuild_cart_totals(user_ids)
+
+
 admin.site.register(Favorite)
-admin.site.register(IngredientInRecipe)
-admin.site.register(PurchaseList)
 admin.site.register(Follow)
 admin.site.register(Tag)
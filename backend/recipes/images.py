@@ -0,0 +1,191 @@
+import binascii
+import io
+import logging
+import os
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from api.caching import bump_version
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+RENDITION_FORMATS = ('webp', 'jpeg')
+RENDITIONS_DIR = 'recipes/renditions'
+DECODE_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64(data):
+    """Decode a base64 string, optionally a data URL, into a temporary file.
+
+    The string is decoded chunk by chunk, so only the chunk and the file
+    are kept in memory, and the file spills to disk once it outgrows
+    ``FILE_UPLOAD_MAX_MEMORY_SIZE``. Raises ``ValueError`` on bad input.
+    """
+    header, separator, payload = data.partition(';base64,')
+    if not separator:
+        payload = header
+    output = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    rest = ''
+    for start in range(0, len(payload), DECODE_CHUNK_SIZE):
+        chunk = rest + ''.join(
+            payload[start:start + DECODE_CHUNK_SIZE].split()
+        )
+        end = len(chunk) - len(chunk) % 4
+        rest = chunk[end:]
+        try:
+            output.write(b64decode(chunk[:end], validate=True))
+        except binascii.Error as error:
+            raise ValueError(str(error))
+    if rest or not output.tell():
+        raise ValueError('Incorrect base64 padding.')
+    output.seek(0)
+    return output
+
+
+def clean_image(file):
+    """Re-encode an uploaded image without its metadata.
+
+    EXIF orientation is applied to the pixels before EXIF, XMP and comments
+    are dropped; only the colour profile is kept. JPEG stays JPEG, other
+    formats are stored as PNG. Returns an ``UploadedFile`` with a random
+    name, raises ``ValueError`` for anything that is not a valid image.
+    """
+    try:
+        with Image.open(file) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise ValueError(f'Unsupported image format {image.format}.')
+            image_format = 'JPEG' if image.format == 'JPEG' else 'PNG'
+            icc_profile = image.info.get('icc_profile')
+            image.load()
+            image = ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as error:
+        raise ValueError(str(error))
+    finally:
+        file.close()
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if image_format == 'JPEG':
+        options['quality'] = settings.RECIPE_IMAGE_QUALITY
+    output = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    image.save(output, image_format, **options)
+    size = output.tell()
+    output.seek(0)
+    extension = 'jpg' if image_format == 'JPEG' else 'png'
+    return UploadedFile(
+        output, name=f'{uuid4()}.{extension}',
+        content_type=Image.MIME[image_format], size=size
+    )
+
+
+def rendition_widths(width):
+    return sorted({min(width, limit) for limit in settings.RECIPE_IMAGE_WIDTHS})
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+
+
+def to_rgb(image):
+    """Flatten transparent images onto a white background for JPEG."""
+    if not has_alpha(image):
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render_rendition(image, image_format):
+    if image_format == 'jpeg':
+        image = to_rgb(image)
+    else:
+        image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+    output = io.BytesIO()
+    image.save(output, image_format, quality=settings.RECIPE_IMAGE_QUALITY)
+    return output.getvalue()
+
+
+def generate_renditions(recipe_id):
+    """Render the downscaled WebP and JPEG copies of a recipe's image.
+
+    The result is stored in ``Recipe.image_renditions`` together with the
+    name of the source image, unless the image has been replaced while the
+    renditions were rendered.
+    """
+    recipe = Recipe.objects.only('image').get(pk=recipe_id)
+    if not recipe.image:
+        return
+    source = recipe.image.name
+    storage = recipe.image.storage
+    stem = os.path.splitext(os.path.basename(source))[0]
+    renditions = {'source': source}
+    with recipe.image.open('rb'), Image.open(recipe.image) as image:
+        image.load()
+        for width in rendition_widths(image.width):
+            height = max(1, round(image.height * width / image.width))
+            resized = image
+            if width != image.width:
+                resized = image.resize((width, height), Image.LANCZOS)
+            for image_format in RENDITION_FORMATS:
+                name = f'{RENDITIONS_DIR}/{stem}-{width}.{image_format}'
+                storage.delete(name)
+                name = storage.save(
+                    name, ContentFile(render_rendition(resized, image_format))
+                )
+                renditions.setdefault(image_format, {})[str(width)] = name
+    if Recipe.objects.filter(pk=recipe_id, image=source).update(
+        image_renditions=renditions
+    ):
+        bump_version('recipes')
+
+
+executor = None
+executor_lock = Lock()
+
+
+def get_executor():
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+        return executor
+
+
+def run_in_worker(recipe_id):
+    try:
+        generate_renditions(recipe_id)
+    except Exception:
+        logger.exception('Could not render images of recipe %s', recipe_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_renditions(recipe_id):
+    """Render a recipe's image renditions once the transaction commits.
+
+    The work is handed to a pool of ``RECIPE_IMAGE_WORKERS`` threads, with
+    no workers configured it runs right after the commit instead.
+    """
+    if settings.RECIPE_IMAGE_WORKERS:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_worker, recipe_id)
+        )
+    else:
+        transaction.on_commit(lambda: generate_renditions(recipe_id))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import CartIngredientTotal
+from recipes.services import rebuild_cart_totals, recompute_cart_totals
+
+
+def drifted_users(expected, actual):
+    """Merge two ``(user_id, ingredient_id, amount, recipes_count)`` row
+    streams ordered by user and ingredient and return the users whose rows
+    differ."""
+    drifted = set()
+    expected_row = next(expected, None)
+    actual_row = next(actual, None)
+    while expected_row is not None or actual_row is not None:
+        if actual_row is None or (
+            expected_row is not None and expected_row[:2] < actual_row[:2]
+        ):
+            drifted.add(expected_row[0])
+            expected_row = next(expected, None)
+        elif expected_row is None or actual_row[:2] < expected_row[:2]:
+            drifted.add(actual_row[0])
+            actual_row = next(actual, None)
+        else:
+            if expected_row != actual_row:
+                drifted.add(expected_row[0])
+            expected_row = next(expected, None)
+            actual_row = next(actual, None)
+    return drifted
+
+
+class Command(BaseCommand):
+    help = ('Compare the stored shopping cart totals with a full recompute '
+            'from the carts and recipe ingredients.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Rebuild the totals of the users that drifted.'
+        )
+
+    def handle(self, *args, **options):
+        actual = CartIngredientTotal.objects.order_by(
+            'user', 'ingredient'
+        ).values_list('user', 'ingredient', 'amount', 'recipes_count')
+        drifted = drifted_users(
+            recompute_cart_totals().iterator(), actual.iterator()
+        )
+        self.stdout.write(f'cart totals: {len(drifted)} drifted users')
+        if not drifted:
+            return
+        if not options['fix']:
+            raise CommandError(
+                'Cart totals differ from a full recompute, run with --fix.'
+            )
+        rebuild_cart_totals(sorted(drifted))
+        self.stdout.write(f'Rebuilt the cart totals of {len(drifted)} users.')
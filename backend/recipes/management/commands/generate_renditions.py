@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform
+
+from recipes.images import generate_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Render the downscaled copies of recipe images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Render again the images that already have renditions.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.annotate(
+                source=KeyTextTransform('source', 'image_renditions')
+            ).filter(Q(source__isnull=True) | ~Q(source=F('image')))
+        ids = list(recipes.order_by('pk').values_list('pk', flat=True))
+        rendered = 0
+        for recipe_id in ids:
+            try:
+                generate_renditions(recipe_id)
+            except OSError as error:
+                self.stderr.write(f'Recipe {recipe_id}: {error}')
+            else:
+                rendered += 1
+        self.stdout.write(f'Rendered images of {rendered} recipes.')
@@ -0,0 +1,138 @@
+import csv
+import json
+import re
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.caching import bump_version
+from recipes.models import Ingredient
+
+DEFAULT_PATH = Path(settings.BASE_DIR).parent / 'data' / 'ingredients.csv'
+SEPARATORS = re.compile(r'[\s,\[\]]*')
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1] if len(row) > 1 else ''
+
+
+def read_json(file, buffer_size=64 * 1024):
+    """Yield ingredients from a JSON array without loading it whole.
+
+    Both plain ``{"name", "measurement_unit"}`` objects and Django fixture
+    objects with a ``fields`` key are accepted.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position < len(buffer):
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                item = item.get('fields', item)
+                yield item['name'], item.get('measurement_unit', '')
+                continue
+        elif eof:
+            return
+        # Only the undecoded tail is kept when more of the file is read.
+        chunk = file.read(buffer_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = 'Load the ingredient catalog from a CSV or JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Input format, guessed from the file extension by default.'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--upsert', action='store_true',
+            help='Update the measurement unit of existing ingredients.'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Unknown input format: {file_format}')
+        if not path.exists():
+            raise CommandError(f'File does not exist: {path}')
+
+        started = time.monotonic()
+        rows = updated = 0
+        # Rows skipped by ignore_conflicts are not reported back, so the
+        # created ones are counted from the table.
+        initial_count = Ingredient.objects.count()
+        with open(path, encoding='utf-8') as file:
+            ingredients = READERS[file_format](file)
+            while True:
+                chunk = list(islice(ingredients, options['chunk_size']))
+                if not chunk:
+                    break
+                rows += len(chunk)
+                updated += self.load_chunk(chunk, options['upsert'])
+
+        created = Ingredient.objects.count() - initial_count
+        if created or updated:
+            bump_version('ingredients')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {rows} rows in {elapsed:.2f}s '
+            f'({rows / max(elapsed, 1e-6):.0f} rows/s): '
+            f'{created} created, {updated} updated.'
+        ))
+
+    @transaction.atomic
+    def load_chunk(self, chunk, upsert):
+        units = {}
+        for name, measurement_unit in chunk:
+            name = name.strip()
+            if name:
+                units[name] = measurement_unit.strip()
+
+        existing = Ingredient.objects.filter(name__in=units).only(
+            'id', 'name', 'measurement_unit'
+        )
+        changed = []
+        for ingredient in existing:
+            measurement_unit = units.pop(ingredient.name)
+            if upsert and ingredient.measurement_unit != measurement_unit:
+                ingredient.measurement_unit = measurement_unit
+                changed.append(ingredient)
+        if changed:
+            Ingredient.objects.bulk_update(
+                changed, ['measurement_unit'], batch_size=1000
+            )
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in units.items()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True
+        )
+        return len(changed)
@@ -0,0 +1,68 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Follow, PurchaseList, Recipe, User
+from recipes.services import tags_mask
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', PurchaseList, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+)
+
+
+def actual_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ('Recompute the denormalized favorite, cart, recipe and follower '
+            'counters and the recipe tag masks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report the number of drifted rows.'
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        for model, counter, source, field in COUNTERS:
+            drifted = model.objects.annotate(
+                actual=actual_count(source, field)
+            ).exclude(**{counter: F('actual')})
+            drifted_count = drifted.count()
+            if drifted_count and not options['dry_run']:
+                model.objects.filter(pk__in=drifted.values('pk')).update(
+                    **{counter: actual_count(source, field)}
+                )
+            self.stdout.write(
+                f'{model._meta.model_name}.{counter}: '
+                f'{drifted_count} drifted rows'
+            )
+        self.recount_tags_masks(options['dry_run'])
+
+    def recount_tags_masks(self, dry_run):
+        tag_ids = defaultdict(list)
+        for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+            'recipe_id', 'tag_id'
+        ).iterator():
+            tag_ids[recipe_id].append(tag_id)
+        drifted = []
+        for recipe in Recipe.objects.only('id', 'tags_mask').iterator():
+            mask = tags_mask(tag_ids[recipe.id])
+            if recipe.tags_mask != mask:
+                recipe.tags_mask = mask
+                drifted.append(recipe)
+        if drifted and not dry_run:
+            Recipe.objects.bulk_update(drifted, ['tags_mask'], batch_size=1000)
+        self.stdout.write(f'recipe.tags_mask: {len(drifted)} drifted rows')
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from recipes.models import FeedEntry
+from recipes.services import trim_feed
+
+
+class Command(BaseCommand):
+    help = 'Trim the feeds of all users to FEED_MAX_LENGTH entries.'
+
+    def handle(self, *args, **options):
+        users = FeedEntry.objects.values('user').annotate(
+            entries=Count('id')
+        ).filter(entries__gt=settings.FEED_MAX_LENGTH).values_list(
+            'user', flat=True
+        )
+        deleted = sum(trim_feed(user_id) for user_id in users)
+        self.stdout.write(f'Deleted {deleted} feed entries.')
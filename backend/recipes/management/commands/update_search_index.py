@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.services import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search vectors of all recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        ids = list(Recipe.objects.order_by('pk').values_list('pk', flat=True))
+        chunk_size = options['chunk_size']
+        for start in range(0, len(ids), chunk_size):
+            update_search_vectors(
+                Recipe.objects.filter(pk__in=ids[start:start + chunk_size])
+            )
+        self.stdout.write(f'Updated {len(ids)} recipes.')
@@ -1,10 +1,26 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 
 
 User = get_user_model()
 
+# Largest primary key of the ``BigAutoField`` ids.
+MAX_ID = 2 ** 63 - 1
+
+
+class SearchVectorIndex(GinIndex):
+    """GIN index on Postgres, a plain index on other backends."""
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(
+                self, model, schema_editor, using=using, **kwargs
+            )
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
 
 class Tag(models.Model):
     name = models.CharField(max_length=255, verbose_name="Tag's name")
@@ -57,9 +73,41 @@ class Recipe(models.Model):
         auto_now_add=True,
         db_index=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name="Times added to favorites",
+        default=0, editable=False, db_index=True
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name="Times added to shopping carts",
+        default=0, editable=False, db_index=True
+    )
+    tags_mask = models.BigIntegerField(
+        verbose_name="Bitmask of the recipe's tag ids",
+        default=0, editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+    fanned_out = models.BooleanField(
+        verbose_name="Copied into the followers' feeds",
+        default=True, editable=False
+    )
+    image_renditions = models.JSONField(
+        verbose_name="Downscaled copies of the image",
+        default=dict, blank=True, editable=False
+    )
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_not_fanned_out_idx',
+                         condition=models.Q(fanned_out=False)),
+            SearchVectorIndex(fields=['search_vector'],
+                              name='recipe_search_vector_idx'),
+        ]
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
 
@@ -124,6 +172,43 @@ class PurchaseList(models.Model):
         return f'Purchase: {self.recipe.name}'
 
 
+class CartIngredientTotal(models.Model):
+    """Total amount of an ingredient over the recipes in a user's cart.
+
+    Kept up to date by the cart services whenever the cart or the
+    ingredients of a recipe in it change, so the shopping list is read
+    from the user's rows alone. ``recipes_count`` is the number of cart
+    recipes using the ingredient, rows are deleted once it drops to zero.
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='User',
+        on_delete=models.CASCADE,
+        related_name='cart_totals'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ingredient',
+        on_delete=models.CASCADE,
+        related_name='cart_totals'
+    )
+    amount = models.BigIntegerField(verbose_name='Amount')
+    recipes_count = models.IntegerField(verbose_name='Recipes')
+
+    class Meta:
+        verbose_name = 'Cart ingredient total'
+        verbose_name_plural = 'Cart ingredient totals'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient_total'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}. Cart ingredient: {self.ingredient_id}'
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -178,3 +263,41 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.user}. Recipe: {self.recipe.id}.{self.recipe.name}'
+
+
+class FeedEntry(models.Model):
+    """A recipe in the feed of a user following its author.
+
+    ``pub_date`` is copied from the recipe, so a page of the feed is read
+    from the ``(user, pub_date, recipe)`` index alone.
+    """
+    user = models.ForeignKey(
+        User,
+        verbose_name='User',
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Recipe',
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
+    pub_date = models.DateTimeField(verbose_name='Publication date')
+
+    class Meta:
+        verbose_name = 'Feed entry'
+        verbose_name_plural = 'Feed entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user}. Feed recipe: {self.recipe_id}'
@@ -0,0 +1,618 @@
+import re
+from functools import partial
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connections, router, transaction
+from django.db.models import (Count, Exists, F, Min, OuterRef, Q, Subquery,
+                              Sum, Value)
+from django.db.models.functions import Coalesce, Greatest, Lower, Trim
+
+from .models import (CartIngredientTotal, Favorite, FeedEntry, Follow,
+                     IngredientInRecipe, PurchaseList, Recipe, User)
+from .units import humanize_amount, unit_expressions
+
+MAX_TAG_BIT_ID = 63
+CART_TOTALS_BATCH_SIZE = 1000
+
+
+def tag_bit(tag_id):
+    """Return the bit of a tag in ``Recipe.tags_mask``.
+
+    Only ids 1 to 63 fit into the signed 64-bit column, larger ids get
+    ``None`` and have to be matched through the tags relation.
+    """
+    if 0 < tag_id <= MAX_TAG_BIT_ID:
+        return 1 << (tag_id - 1)
+    return None
+
+
+def tags_mask(tag_ids):
+    mask = 0
+    for tag_id in tag_ids:
+        mask |= tag_bit(tag_id) or 0
+    return mask
+
+
+def update_search_vectors(recipes):
+    """Rebuild the full-text search vector of the given recipes.
+
+    The vector weights the recipe name highest, then the names of its
+    ingredients, then the description. Backends without full-text search
+    keep an empty vector and are served by ``search_recipes`` fallback.
+    """
+    if connections[recipes.db].vendor != 'postgresql':
+        return
+    config = settings.SEARCH_CONFIG
+    ingredient_names = Subquery(
+        IngredientInRecipe.objects.filter(recipe=OuterRef('pk')).order_by()
+        .values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    recipes.update(search_vector=(
+        SearchVector('name', weight='A', config=config)
+        + SearchVector(Coalesce(ingredient_names, Value('')),
+                       weight='B', config=config)
+        + SearchVector('text', weight='C', config=config)
+    ))
+
+
+def flush_search_updates(connection):
+    """On-commit callback refreshing the search vectors of the recipes
+    pending on the connection with a single UPDATE."""
+    recipe_ids = connection.pending_search_updates
+    if not recipe_ids:
+        return
+    connection.pending_search_updates = set()
+    update_search_vectors(
+        Recipe.objects.using(connection.alias).filter(pk__in=recipe_ids)
+    )
+
+
+def schedule_search_update(*recipe_ids):
+    """Refresh the search vectors of recipes once the transaction commits.
+
+    Ids are collected in a set of the connection, and the first callback
+    to run after the commit refreshes them all and clears it, so the
+    others have nothing left to do. Every call registers its callback:
+    the ids of a rolled back savepoint stay pending and are refreshed on
+    the next commit, which is harmless. Outside of a transaction the
+    refresh runs at once.
+    """
+    connection = transaction.get_connection(router.db_for_write(Recipe))
+    if not connection.in_atomic_block:
+        update_search_vectors(Recipe.objects.filter(pk__in=recipe_ids))
+        return
+    if not hasattr(connection, 'pending_search_updates'):
+        connection.pending_search_updates = set()
+    connection.pending_search_updates.update(recipe_ids)
+    transaction.on_commit(partial(flush_search_updates, connection),
+                          using=connection.alias)
+
+
+def recipe_ingredient_amounts(ingredient_amounts):
+    """Return ``{(recipe_id, ingredient_id): amount}`` of the rows of an
+    ``IngredientInRecipe`` queryset."""
+    return {
+        (recipe_id, ingredient_id): amount
+        for recipe_id, ingredient_id, amount in ingredient_amounts.values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        )
+    }
+
+
+def ingredient_changes(before, after):
+    """Compare two ``recipe_ingredient_amounts`` reads and return the
+    ``{recipe_id: {ingredient_id: (amount, recipes_count)}}`` changes."""
+    changes = {}
+    for recipe_id, ingredient_id in before.keys() | after.keys():
+        old = before.get((recipe_id, ingredient_id))
+        new = after.get((recipe_id, ingredient_id))
+        if old != new:
+            changes.setdefault(recipe_id, {})[ingredient_id] = (
+                (new or 0) - (old or 0),
+                (new is not None) - (old is not None)
+            )
+    return changes
+
+
+def search_recipes(queryset, text):
+    """Filter recipes by words matching their name, description or
+    ingredients, best matches first. Every word matches as a prefix."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return queryset
+    if connections[queryset.db].vendor != 'postgresql':
+        return search_recipes_fallback(queryset, words)
+    query = SearchQuery(
+        ' & '.join(f'{word}:*' for word in words),
+        search_type='raw', config=settings.SEARCH_CONFIG
+    )
+    return queryset.filter(search_vector=query).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    ).order_by('-search_rank', '-pub_date')
+
+
+def search_recipes_fallback(queryset, words):
+    """Unranked ``search_recipes`` for backends without full-text search:
+    every word has to be a substring of the name, the description or an
+    ingredient name."""
+    for word in words:
+        queryset = queryset.filter(
+            Q(name__icontains=word) | Q(text__icontains=word)
+            | Exists(IngredientInRecipe.objects.filter(
+                recipe=OuterRef('pk'),
+                ingredient__name__icontains=word
+            ))
+        )
+    return queryset
+
+
+def user_recipe_flags(user):
+    """Return the annotations of the per-user flags of a recipe."""
+    return {
+        'is_favorited': Exists(Favorite.objects.filter(
+            user=user, recipe_id=OuterRef('pk')
+        )),
+        'is_in_shopping_cart': Exists(PurchaseList.objects.filter(
+            user=user, recipe_id=OuterRef('pk')
+        )),
+        'author_is_subscribed': Exists(Follow.objects.filter(
+            user=user, author_id=OuterRef('author_id')
+        )),
+    }
+
+
+def get_shopping_list(user):
+    """Yield the consolidated ingredients of the user's shopping cart.
+
+    The list is read from the user's ``CartIngredientTotal`` rows. Amounts
+    are converted to the base unit of their measurement unit and summed
+    per case-insensitive ingredient name and base unit in the same query,
+    so "200 г" and "1 кг" of sugar end up on one line. Totals are then
+    shown in the most readable unit, one
+    ``{'name', 'total_amount', 'measurement_unit'}`` row per line, ordered
+    by name.
+    """
+    base_unit, factor = unit_expressions()
+    rows = (
+        CartIngredientTotal.objects
+        .filter(user=user)
+        .annotate(unit=Lower(Trim('ingredient__measurement_unit')))
+        .values(key=Lower(Trim('ingredient__name')), base_unit=base_unit)
+        .annotate(name=Min(Trim('ingredient__name')),
+                  total=Sum(F('amount') * factor))
+        .order_by('key', 'base_unit')
+    )
+    for row in rows.iterator():
+        amount, unit = humanize_amount(row['total'], row['base_unit'])
+        yield {
+            'name': row['name'],
+            'total_amount': amount,
+            'measurement_unit': unit,
+        }
+
+
+def update_counter(model, pk, field, delta):
+    """Atomically add ``delta`` to a denormalized counter column."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def insert_sql(model, instances, connection, returning=None):
+    """Build an ``INSERT ... ON CONFLICT DO NOTHING`` of the instances,
+    optionally returning the ``returning`` column of the written rows."""
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+    params = [
+        field.get_db_prep_save(field.pre_save(instance, True), connection)
+        for instance in instances
+        for field in fields
+    ]
+    quote_name = connection.ops.quote_name
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+    sql = 'INSERT INTO {} ({}) VALUES {} ON CONFLICT DO NOTHING'.format(
+        quote_name(model._meta.db_table),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join([row] * len(instances)),
+    )
+    if returning:
+        sql += f' RETURNING {quote_name(returning)}'
+    return sql, params
+
+
+def insert_ignore_conflicts(model, **values):
+    """Insert a row unless it breaks one of the model's unique constraints.
+
+    Runs a single ``INSERT ... ON CONFLICT DO NOTHING`` and reports whether
+    a row was written, so duplicates are detected from the affected row
+    count instead of a racy ``exists()`` check before the insert.
+    """
+    connection = connections[router.db_for_write(model)]
+    sql, params = insert_sql(model, [model(**values)], connection)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
+
+
+def insert_many_ignore_conflicts(model, instances, returning):
+    """Insert many rows at once, see ``insert_ignore_conflicts``.
+
+    Returns the ``returning`` column of the rows actually written, read
+    back with ``RETURNING``, so rows inserted by a concurrent request are
+    not reported again.
+    """
+    if not instances:
+        return []
+    connection = connections[router.db_for_write(model)]
+    sql, params = insert_sql(model, instances, connection, returning)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [value for value, in cursor.fetchall()]
+
+
+def delete_returning(model, returning, **filters):
+    """Delete the rows matching ``column=value`` or ``column=[values]``
+    filters with one ``DELETE ... RETURNING`` and return the ``returning``
+    column of the rows actually deleted.
+
+    Only for models nothing else refers to, the rows are not collected
+    and no delete signals are sent.
+    """
+    connection = connections[router.db_for_write(model)]
+    quote_name = connection.ops.quote_name
+    conditions = []
+    params = []
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            if not value:
+                return []
+            conditions.append('{} IN ({})'.format(
+                quote_name(column), ', '.join(['%s'] * len(value))
+            ))
+            params.extend(value)
+        else:
+            conditions.append(f'{quote_name(column)} = %s')
+            params.append(value)
+    sql = 'DELETE FROM {} WHERE {} RETURNING {}'.format(
+        quote_name(model._meta.db_table), ' AND '.join(conditions),
+        quote_name(returning)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [value for value, in cursor.fetchall()]
+
+
+@transaction.atomic
+def add_favorite(user, recipe):
+    added = insert_ignore_conflicts(Favorite, user=user, recipe=recipe)
+    if added:
+        update_counter(Recipe, recipe.id, 'favorites_count', 1)
+    return added
+
+
+@transaction.atomic
+def remove_favorite(user, recipe_id):
+    deleted, _ = Favorite.objects.filter(
+        user=user, recipe_id=recipe_id
+    ).delete()
+    if deleted:
+        update_counter(Recipe, recipe_id, 'favorites_count', -1)
+    return bool(deleted)
+
+
+@transaction.atomic
+def add_to_cart(user, recipe):
+    added = insert_ignore_conflicts(PurchaseList, user=user, recipe=recipe)
+    if added:
+        update_counter(Recipe, recipe.id, 'in_carts_count', 1)
+        update_cart_totals(user, [recipe.id], 1)
+    return added
+
+
+@transaction.atomic
+def remove_from_cart(user, recipe_id):
+    deleted, _ = PurchaseList.objects.filter(
+        user=user, recipe_id=recipe_id
+    ).delete()
+    if deleted:
+        update_counter(Recipe, recipe_id, 'in_carts_count', -1)
+        update_cart_totals(user, [recipe_id], -1)
+    return bool(deleted)
+
+
+def quoted_table(model):
+    connection = connections[router.db_for_write(model)]
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def merge_cart_totals(select, params):
+    """Add the ``(user_id, ingredient_id, amount, recipes_count)`` rows of
+    ``select`` to ``CartIngredientTotal`` with a single
+    ``INSERT ... ON CONFLICT DO UPDATE``.
+    """
+    connection = connections[router.db_for_write(CartIngredientTotal)]
+    table = quoted_table(CartIngredientTotal)
+    sql = (
+        'INSERT INTO {table} (user_id, ingredient_id, amount, recipes_count) '
+        '{select} ON CONFLICT (user_id, ingredient_id) DO UPDATE SET '
+        'amount = {table}.amount + excluded.amount, '
+        'recipes_count = {table}.recipes_count + excluded.recipes_count'
+    ).format(table=table, select=select)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def update_cart_totals(user, recipe_ids, sign):
+    """Add the ingredients of recipes put into the user's cart to its
+    totals, or subtract them with ``sign=-1`` when they are taken out.
+
+    Called after the recipe counters are updated, so the recipe rows are
+    locked and an ingredient edit running at the same time either sees
+    the cart change or is seen by it.
+    """
+    if not recipe_ids:
+        return
+    merge_cart_totals(
+        'SELECT %s, ingredient_id, %s * SUM(amount), %s * COUNT(*) '
+        'FROM {} WHERE recipe_id IN ({}) GROUP BY ingredient_id'.format(
+            quoted_table(IngredientInRecipe),
+            ', '.join(['%s'] * len(recipe_ids))
+        ),
+        [user.id, sign, sign, *recipe_ids]
+    )
+    if sign < 0:
+        CartIngredientTotal.objects.filter(
+            user=user, recipes_count__lte=0
+        ).delete()
+
+
+def update_carts_of_recipe(recipe_id, changes):
+    """Apply ``{ingredient_id: (amount, recipes_count)}`` changes of a
+    recipe's ingredients to the totals of every cart holding the recipe.
+    """
+    if not changes:
+        return
+    merge_cart_totals(
+        'SELECT purchase.user_id, changes.column1, changes.column2, '
+        'changes.column3 FROM {} AS purchase, (VALUES {}) AS changes '
+        'WHERE purchase.recipe_id = %s'.format(
+            quoted_table(PurchaseList),
+            ', '.join(['(%s, %s, %s)'] * len(changes))
+        ),
+        [
+            *(value for ingredient_id, (amount, count) in changes.items()
+              for value in (ingredient_id, amount, count)),
+            recipe_id
+        ]
+    )
+    CartIngredientTotal.objects.filter(
+        user__purchases__recipe_id=recipe_id,
+        ingredient_id__in=changes,
+        recipes_count__lte=0
+    ).delete()
+
+
+def lock_recipes(recipe_ids):
+    """Lock the recipe rows, as adding a recipe to a cart does when it
+    counts it, so a cart change running at the same time either is seen
+    by the caller's cart updates or sees the caller's changes."""
+    list(Recipe.objects.select_for_update().filter(
+        pk__in=recipe_ids
+    ).order_by('pk').values_list('pk', flat=True))
+
+
+def remove_recipe_from_carts(recipe_id):
+    """Subtract a recipe about to be deleted from the carts holding it."""
+    lock_recipes([recipe_id])
+    update_carts_of_recipe(recipe_id, {
+        ingredient_id: (-amount, -1)
+        for ingredient_id, amount in IngredientInRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    })
+
+
+def recompute_cart_totals():
+    """Return a ``(user_id, ingredient_id, amount, recipes_count)`` query
+    computing the cart totals from scratch, ordered by user and
+    ingredient.
+    """
+    return (
+        IngredientInRecipe.objects
+        .filter(recipe__customers__isnull=False)
+        .values_list('recipe__customers__user', 'ingredient')
+        .annotate(amount=Sum('amount'), recipes_count=Count('id'))
+        .order_by('recipe__customers__user', 'ingredient')
+    )
+
+
+@transaction.atomic
+def rebuild_cart_totals(user_ids):
+    """Replace the cart totals of the users with a full recompute."""
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), CART_TOTALS_BATCH_SIZE):
+        batch = user_ids[start:start + CART_TOTALS_BATCH_SIZE]
+        CartIngredientTotal.objects.filter(user_id__in=batch).delete()
+        merge_cart_totals(
+            'SELECT purchase.user_id, ingredient.ingredient_id, '
+            'SUM(ingredient.amount), COUNT(*) FROM {} AS purchase '
+            'JOIN {} AS ingredient '
+            'ON ingredient.recipe_id = purchase.recipe_id '
+            'WHERE purchase.user_id IN ({}) '
+            'GROUP BY purchase.user_id, ingredient.ingredient_id'.format(
+                quoted_table(PurchaseList), quoted_table(IngredientInRecipe),
+                ', '.join(['%s'] * len(batch))
+            ),
+            batch
+        )
+
+
+@transaction.atomic
+def subscribe(user, author):
+    added = insert_ignore_conflicts(Follow, user=user, author=author)
+    if added:
+        update_counter(User, author.id, 'followers_count', 1)
+        backfill_feed(user, [author.id])
+    return added
+
+
+@transaction.atomic
+def unsubscribe(user, author_id):
+    deleted, _ = Follow.objects.filter(user=user, author_id=author_id).delete()
+    if deleted:
+        update_counter(User, author_id, 'followers_count', -1)
+        remove_from_feed(user, [author_id])
+    return bool(deleted)
+
+
+def fan_out_recipe(recipe):
+    """Add a new recipe to the feeds of its author's followers.
+
+    Recipes of authors with more than ``FEED_FANOUT_LIMIT`` followers are
+    not copied but marked as not ``fanned_out``, the feed reads them from
+    the author's recipes instead, also after the author drops back under
+    the limit.
+    """
+    if not User.objects.filter(
+        pk=recipe.author_id,
+        followers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).exists():
+        recipe.fanned_out = False
+        Recipe.objects.filter(pk=recipe.pk).update(fanned_out=False)
+        return
+    followers = Follow.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe=recipe, pub_date=recipe.pub_date)
+            for user_id in followers.iterator()
+        ),
+        batch_size=1000, ignore_conflicts=True
+    )
+
+
+def backfill_feed(user, author_ids):
+    """Copy the latest recipes of newly followed authors into a feed."""
+    recipes = Recipe.objects.filter(
+        author_id__in=author_ids,
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).order_by('-pub_date', '-id').values_list('id', 'pub_date')
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user=user, recipe_id=recipe_id, pub_date=pub_date)
+            for recipe_id, pub_date in recipes[:settings.FEED_MAX_LENGTH]
+        ),
+        batch_size=1000, ignore_conflicts=True
+    )
+    trim_feed(user.id)
+
+
+def remove_from_feed(user, author_ids):
+    FeedEntry.objects.filter(
+        user=user, recipe__author_id__in=author_ids
+    ).delete()
+
+
+def trim_feed(user_id):
+    """Drop the entries of a feed beyond the newest ``FEED_MAX_LENGTH``."""
+    entries = FeedEntry.objects.filter(user_id=user_id)
+    last = entries.order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[settings.FEED_MAX_LENGTH - 1:settings.FEED_MAX_LENGTH]
+    if not last:
+        return 0
+    pub_date, recipe_id = last[0]
+    deleted, _ = entries.filter(
+        Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, recipe_id__lt=recipe_id)
+    ).delete()
+    return deleted
+
+
+def get_feed_sources(user):
+    """Return the querysets a user's feed is merged from.
+
+    Every source is a ``(queryset, date field, recipe id field)`` triple:
+    the user's timeline, the recipes of every followed author too popular
+    for fan-out on write, and the recipes other followed authors published
+    while they were.
+    """
+    popular_authors = Follow.objects.filter(
+        user=user, author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).values_list('author_id', flat=True)
+    not_fanned_out = Recipe.objects.filter(
+        fanned_out=False,
+        author__in=Follow.objects.filter(
+            user=user, author__followers_count__lte=settings.FEED_FANOUT_LIMIT
+        ).values('author_id')
+    )
+    return [
+        (FeedEntry.objects.filter(user=user), 'pub_date', 'recipe_id'),
+        (not_fanned_out, 'pub_date', 'id'),
+    ] + [
+        (Recipe.objects.filter(author_id=author_id), 'pub_date', 'id')
+        for author_id in popular_authors
+    ]
+
+
+@transaction.atomic
+def add_many(model, user, field, ids, counter_field):
+    """Link ``user`` to many targets of a user relation at once.
+
+    ``model`` is one of the user relation models (``Favorite``,
+    ``PurchaseList``, ``Follow``) and ``field`` its foreign key to the
+    target. Unknown ids are found with a single query and the links are
+    written with one ``INSERT ... RETURNING``. Only the targets of rows
+    actually inserted are counted, with one UPDATE, so a link added by a
+    concurrent request is neither counted twice nor reported as added.
+    Returns a status for every requested id.
+    """
+    target_model = model._meta.get_field(field).related_model
+    found = set(
+        target_model.objects.filter(pk__in=ids).values_list('pk', flat=True)
+    )
+    added = set(insert_many_ignore_conflicts(
+        model,
+        [model(user=user, **{f'{field}_id': pk}) for pk in sorted(found)],
+        returning=model._meta.get_field(field).column
+    ))
+    target_model.objects.filter(pk__in=added).update(
+        **{counter_field: F(counter_field) + 1}
+    )
+    if model is PurchaseList:
+        update_cart_totals(user, sorted(added), 1)
+    return {
+        pk: 'added' if pk in added else 'exists' if pk in found
+        else 'not_found'
+        for pk in ids
+    }
+
+
+@transaction.atomic
+def remove_many(model, user, field, ids, counter_field):
+    """Remove links between ``user`` and many targets, see ``add_many``.
+
+    Links are deleted with one ``DELETE ... RETURNING``, so only the
+    targets of rows this call deleted are counted down.
+    """
+    target_model = model._meta.get_field(field).related_model
+    column = model._meta.get_field(field).column
+    removed = set(delete_returning(
+        model, column, user_id=user.id, **{column: list(ids)}
+    ))
+    target_model.objects.filter(pk__in=removed).update(
+        **{counter_field: Greatest(F(counter_field) - 1, 0)}
+    )
+    if model is PurchaseList:
+        update_cart_totals(user, sorted(removed), -1)
+    return {
+        pk: 'removed' if pk in removed else 'not_found'
+        for pk in ids
+    }
@@ -0,0 +1,62 @@
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .images import schedule_renditions
+from .models import Ingredient, Recipe
+from .services import (fan_out_recipe, remove_recipe_from_carts,
+                       schedule_search_update, tag_bit, tags_mask,
+                       update_search_vectors)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bit = tag_bit(instance.pk)
+        recipes = Recipe.objects.filter(pk__in=pk_set or ())
+        if action == 'post_clear':
+            recipes = Recipe.objects.filter(tags_mask__gt=0)
+    else:
+        bit = tags_mask(pk_set or ())
+        recipes = Recipe.objects.filter(pk=instance.pk)
+        if action == 'post_clear':
+            bit = -1
+    if not bit:
+        return
+    if action == 'post_add':
+        recipes.update(tags_mask=F('tags_mask').bitor(bit))
+    else:
+        recipes.update(tags_mask=F('tags_mask').bitand(~bit))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, created, **kwargs):
+    schedule_search_update(instance.pk)
+    if created:
+        fan_out_recipe(instance)
+    if (instance.image and instance.image_renditions.get('source')
+            != instance.image.name):
+        schedule_renditions(instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    # Also run for recipes deleted in the admin or along with their author,
+    # while the purchases of the recipe are still there.
+    remove_recipe_from_carts(instance.pk)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_deleted(instance, **kwargs):
+    # Refreshed once the cascade has removed the ingredient from them.
+    schedule_search_update(*Recipe.objects.filter(
+        ingredients=instance
+    ).values_list('pk', flat=True))
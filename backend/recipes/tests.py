@@ -0,0 +1,315 @@
+from unittest import skipUnless
+
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+
+from api.filters import RecipeFilter
+from api.serializers import CreateRecipeSerializer
+from .models import (CartIngredientTotal, Ingredient, IngredientInRecipe,
+                     PurchaseList, Recipe, Tag, User)
+from .services import (add_many, add_to_cart, get_shopping_list,
+                       recompute_cart_totals, remove_from_cart, remove_many,
+                       schedule_search_update, search_recipes,
+                       search_recipes_fallback, update_search_vectors)
+
+
+def create_recipe(author, name, text, ingredients, tags=()):
+    recipe = Recipe.objects.create(
+        author=author, name=name, text=text, cooking_time=10
+    )
+    recipe.tags.set(tags)
+    IngredientInRecipe.objects.bulk_create(
+        IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                           amount=amount)
+        for ingredient, amount in ingredients.items()
+    )
+    return recipe
+
+
+def update_recipe(recipe, ingredients, tags):
+    serializer = CreateRecipeSerializer(recipe, partial=True, data={
+        'ingredients': [
+            {'id': ingredient.id, 'amount': amount}
+            for ingredient, amount in ingredients.items()
+        ],
+        'tags': [tag.id for tag in tags],
+    })
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author', password='pass12345!'
+        )
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch',
+                                     color='#ffffff')
+        cls.beet = Ingredient.objects.create(name='свёкла',
+                                             measurement_unit='г')
+        cls.apples = Ingredient.objects.create(name='яблоки',
+                                               measurement_unit='г')
+        cls.sugar = Ingredient.objects.create(name='сахар',
+                                              measurement_unit='г')
+        cls.borscht = create_recipe(
+            cls.author, 'борщ', 'суп на говяжьем бульоне', {cls.beet: 300},
+            [cls.tag]
+        )
+        cls.charlotte = create_recipe(
+            cls.author, 'шарлотка', 'пирог', {cls.apples: 500, cls.sugar: 200},
+            [cls.tag]
+        )
+        # On-commit refreshes never run for the class-wide transaction.
+        update_search_vectors(Recipe.objects.all())
+
+    def search(self, text):
+        return list(search_recipes(Recipe.objects.all(), text))
+
+    def test_fallback_matches_name_text_and_ingredients(self):
+        recipes = Recipe.objects.all()
+        self.assertEqual(
+            list(search_recipes_fallback(recipes, ['борщ'])), [self.borscht]
+        )
+        self.assertEqual(
+            list(search_recipes_fallback(recipes, ['бульон'])),
+            [self.borscht]
+        )
+        self.assertEqual(
+            list(search_recipes_fallback(recipes, ['яблок'])),
+            [self.charlotte]
+        )
+        self.assertEqual(
+            list(search_recipes_fallback(recipes, ['пирог', 'сахар'])),
+            [self.charlotte]
+        )
+        self.assertEqual(
+            list(search_recipes_fallback(recipes, ['пирог', 'свёкла'])), []
+        )
+
+    def test_search_matches_prefixes(self):
+        self.assertEqual(self.search('шарл'), [self.charlotte])
+        self.assertEqual(self.search('суп свёкл'), [self.borscht])
+        self.assertEqual(self.search('!!'), [self.charlotte, self.borscht])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Full-text search only')
+    def test_search_vectors_follow_ingredient_edits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            update_recipe(self.borscht, {self.sugar: 10}, [self.tag])
+        self.assertEqual(self.search('свёкл'), [])
+        self.assertEqual(self.search('сахар'),
+                         [self.charlotte, self.borscht])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sugar.delete()
+        self.assertEqual(self.search('сахар'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Full-text search only')
+    def test_search_updates_are_flushed_once_per_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            schedule_search_update(self.borscht.pk)
+            try:
+                with transaction.atomic():
+                    update_recipe(self.borscht, {self.sugar: 10}, [self.tag])
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+            update_recipe(self.charlotte, {self.beet: 10}, [self.tag])
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(connection.pending_search_updates, set())
+        self.assertCountEqual(self.search('свёкл'),
+                              [self.charlotte, self.borscht])
+        self.assertEqual(self.search('яблок'), [])
+
+    def test_ingredient_amounts_are_fast_deleted(self):
+        with self.assertNumQueries(1):
+            IngredientInRecipe.objects.filter(recipe=self.borscht).delete()
+
+
+class CartTotalsTests(TestCase):
+    """Cart totals always match a recompute from scratch."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.alice, cls.bob = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name=name, password='pass12345!'
+            )
+            for name in ('author', 'alice', 'bob')
+        ]
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch',
+                                     color='#ffffff')
+        cls.beet, cls.apples, cls.sugar = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('свёкла', 'яблоки', 'сахар')
+        ]
+        cls.borscht = create_recipe(
+            cls.author, 'борщ', 'суп', {cls.beet: 300, cls.sugar: 5},
+            [cls.tag]
+        )
+        cls.charlotte = create_recipe(
+            cls.author, 'шарлотка', 'пирог', {cls.apples: 500, cls.sugar: 200},
+            [cls.tag]
+        )
+
+    def setUp(self):
+        for user in (self.alice, self.bob):
+            add_to_cart(user, self.borscht)
+            add_to_cart(user, self.charlotte)
+
+    def assert_totals_match(self):
+        self.assertEqual(
+            list(CartIngredientTotal.objects.order_by(
+                'user', 'ingredient'
+            ).values_list('user', 'ingredient', 'amount', 'recipes_count')),
+            list(recompute_cart_totals())
+        )
+
+    def test_add_and_remove(self):
+        self.assert_totals_match()
+        self.assertFalse(add_to_cart(self.alice, self.borscht))
+        remove_from_cart(self.alice, self.borscht.pk)
+        self.assert_totals_match()
+        self.assertFalse(remove_from_cart(self.alice, self.borscht.pk))
+        self.assert_totals_match()
+
+    def test_batch(self):
+        recipe_ids = [self.borscht.pk, self.charlotte.pk]
+        remove_many(PurchaseList, self.alice, 'recipe', recipe_ids,
+                    'in_carts_count')
+        self.assert_totals_match()
+        remove_many(PurchaseList, self.bob, 'recipe', [self.borscht.pk],
+                    'in_carts_count')
+        add_many(PurchaseList, self.bob, 'recipe', recipe_ids,
+                 'in_carts_count')
+        self.assert_totals_match()
+
+    def test_recipe_edit(self):
+        update_recipe(self.borscht, {self.beet: 250, self.apples: 1},
+                      [self.tag])
+        self.assert_totals_match()
+
+    def test_recipe_delete(self):
+        self.borscht.delete()
+        self.assert_totals_match()
+        self.author.delete()
+        self.assert_totals_match()
+        self.assertFalse(CartIngredientTotal.objects.exists())
+
+    def test_admin_edits(self):
+        admin = User.objects.create_superuser(
+            email='admin@example.com', username='admin', first_name='Admin',
+            last_name='Admin', password='pass12345!'
+        )
+        self.client.force_login(admin)
+        amount = IngredientInRecipe.objects.get(
+            recipe=self.borscht, ingredient=self.beet
+        )
+        response = self.client.post(
+            f'/admin/recipes/ingredientinrecipe/{amount.pk}/change/',
+            {'recipe': self.borscht.pk, 'ingredient': self.apples.pk,
+             'amount': 7}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_totals_match()
+        purchase = PurchaseList.objects.get(user=self.bob,
+                                            recipe=self.charlotte)
+        response = self.client.post(
+            f'/admin/recipes/purchaselist/{purchase.pk}/delete/',
+            {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_totals_match()
+        response = self.client.post(
+            f'/admin/recipes/recipe/{self.charlotte.pk}/delete/',
+            {'post': 'yes'}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assert_totals_match()
+
+
+class ShoppingListTests(TestCase):
+    """The shopping list sums amounts of compatible units only."""
+
+    def test_units_are_converted_before_summing(self):
+        user = User.objects.create_user(
+            email='cook@example.com', username='cook',
+            first_name='Cook', last_name='Cook', password='pass12345!'
+        )
+        # Names differ by whitespace only, which the list ignores.
+        ingredients = {
+            Ingredient.objects.create(name=name, measurement_unit=unit):
+                amount
+            for name, unit, amount in (
+                ('сахар', 'г', 200),
+                (' сахар', 'кг', 1),
+                ('молоко', 'мл', 300),
+                (' молоко', 'л', 1),
+                ('мука', 'г', 100),
+                (' мука', 'стакан', 2),
+                ('соль', 'по вкусу', 1),
+                ('яйца', 'шт', 2),
+                (' яйца', 'г', 120),
+            )
+        }
+        add_to_cart(user, create_recipe(user, 'блины', 'Text', ingredients))
+        self.assertEqual(
+            [
+                (row['name'], row['total_amount'], row['measurement_unit'])
+                for row in get_shopping_list(user)
+            ],
+            [
+                ('молоко', 1.3, 'л'),
+                ('мука', 100, 'г'),
+                ('мука', 2, 'стакан'),
+                ('сахар', 1.2, 'кг'),
+                ('соль', None, 'по вкусу'),
+                ('яйца', 120, 'г'),
+                ('яйца', 2, 'шт.'),
+            ]
+        )
+
+
+class TagsMaskTests(TestCase):
+    """``Recipe.tags_mask`` follows every change of the tags relation."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Author', password='pass12345!'
+        )
+        cls.lunch, cls.dinner = [
+            Tag.objects.create(name=slug, slug=slug, color='#ffffff')
+            for slug in ('lunch', 'dinner')
+        ]
+        cls.soup, cls.salad = [
+            Recipe.objects.create(author=author, name=name, text='Text',
+                                  cooking_time=10)
+            for name in ('Soup', 'Salad')
+        ]
+
+    def filter(self, *slugs):
+        return set(RecipeFilter(
+            {'tags': list(slugs)}, Recipe.objects.all()
+        ).qs)
+
+    def test_tags_mask_follows_the_relation(self):
+        self.soup.tags.add(self.lunch, self.dinner)
+        self.salad.tags.set([self.lunch])
+        self.assertEqual(self.filter('lunch'), {self.soup, self.salad})
+        self.assertEqual(self.filter('dinner'), {self.soup})
+        self.soup.tags.remove(self.lunch)
+        self.assertEqual(self.filter('lunch'), {self.salad})
+        self.salad.tags.set([self.dinner])
+        self.assertEqual(self.filter('lunch'), set())
+        self.assertEqual(self.filter('dinner'), {self.soup, self.salad})
+        self.dinner.recipes.remove(self.soup)
+        self.lunch.recipes.add(self.soup)
+        self.assertEqual(self.filter('lunch'), {self.soup})
+        self.soup.tags.clear()
+        self.assertEqual(self.filter('lunch', 'dinner'), {self.salad})
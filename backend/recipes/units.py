@@ -0,0 +1,104 @@
+from functools import lru_cache
+
+from django.db.models import Case, F, IntegerField, Value, When
+
+# Measurement unit -> (base unit, factor). Amounts of a unit are converted
+# to its base unit before they are summed. Units missing here are their
+# own base unit.
+UNIT_CONVERSIONS = {
+    'г': ('г', 1),
+    'гр': ('г', 1),
+    'грамм': ('г', 1),
+    'кг': ('г', 1000),
+    'килограмм': ('г', 1000),
+    'мл': ('мл', 1),
+    'миллилитр': ('мл', 1),
+    'л': ('мл', 1000),
+    'литр': ('мл', 1000),
+    'ч. л.': ('мл', 5),
+    'ч.л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'ст.л.': ('мл', 15),
+    'стакан': ('мл', 250),
+    'шт': ('шт.', 1),
+    'шт.': ('шт.', 1),
+    'штука': ('шт.', 1),
+}
+
+# Base unit -> (unit, factor, step, limit) candidates, largest unit first.
+# A total is shown in the first unit it amounts to at least one of, as a
+# multiple of ``step`` and, if there is a limit, no more than ``limit``.
+DISPLAY_UNITS = {
+    'г': (
+        ('кг', 1000, 0.1, None),
+        ('г', 1, 1, None),
+    ),
+    'мл': (
+        ('л', 1000, 0.1, None),
+        ('стакан', 250, 0.5, 10),
+        ('ст. л.', 15, 0.5, 10),
+        ('ч. л.', 5, 0.5, 6),
+        ('мл', 1, 1, None),
+    ),
+}
+
+# Units that carry no meaningful amount.
+UNCOUNTED_UNITS = {'по вкусу'}
+
+
+def normalize_unit(unit):
+    return unit.strip().lower()
+
+
+@lru_cache(maxsize=None)
+def unit_expressions():
+    """Return the ``(base_unit, factor)`` SQL expressions of the conversion
+    table, built once per process.
+
+    Both read the normalized measurement unit from a ``unit`` annotation,
+    so the conversion runs inside the grouped shopping list query instead
+    of row by row in Python.
+    """
+    table = {
+        normalize_unit(unit): conversion
+        for unit, conversion in UNIT_CONVERSIONS.items()
+    }
+    base_unit = Case(
+        *(When(unit=unit, then=Value(base)) for unit, (base, _) in
+          table.items() if base != unit),
+        default=F('unit')
+    )
+    factor = Case(
+        *(When(unit=unit, then=Value(factor)) for unit, (_, factor) in
+          table.items() if factor != 1),
+        default=Value(1),
+        output_field=IntegerField()
+    )
+    return base_unit, factor
+
+
+def is_multiple(value, step):
+    return abs(value / step - round(value / step)) < 1e-9
+
+
+def humanize_amount(amount, base_unit):
+    """Express a total in base units in the most readable unit.
+
+    Returns ``(amount, unit)``; the amount is ``None`` for units such as
+    "по вкусу".
+    """
+    if base_unit in UNCOUNTED_UNITS:
+        return None, base_unit
+    for unit, factor, step, limit in DISPLAY_UNITS.get(base_unit, ()):
+        value = amount / factor
+        if (value >= 1 and is_multiple(value, step)
+                and (limit is None or value <= limit)):
+            value = round(value, 1)
+            return int(value) if value == int(value) else value, unit
+    return amount, base_unit
+
+
+def format_amount(amount, unit):
+    if amount is None:
+        return unit
+    return f'{amount} {unit}'
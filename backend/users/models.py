@@ -4,6 +4,8 @@ from django.db import models
 
 class CustomUser(AbstractUser):
     email = models.EmailField(unique=True, max_length=254)
+    recipes_count = models.PositiveIntegerField(default=0, editable=False)
+    followers_count = models.PositiveIntegerField(default=0, editable=False)
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
     USERNAME_FIELD = 'email'
 